@@ -18,6 +18,9 @@ from __future__ import print_function
 from keras.layers import LSTM, SimpleRNN, GRU, Flatten, RepeatVector, Permute, Conv1D, GlobalMaxPooling1D
 from tweet_utils import *
 from utils import *
+from batching import bucketed_train_and_validation
+from training import training_callbacks
+from evaluation import evaluate
 import nltk
 import re
 import keras.callbacks
@@ -37,17 +40,31 @@ np.random.seed(42)
 
 
 EmbeddingSize = 100
+PruneEmbedding = True
+BucketBatches = True
+# epochs without a lower val_loss before stopping / reducing the learning
+# rate (None never reduces it)
+Patience = 7
+ReduceLRPatience = None
+
+train_fps = [os.path.join('data', 'clickbait17-validation'),
+             os.path.join('data', 'clickbait17-train-170331')]
+test_fps = [os.path.join('data', 'clickbait17-test')]
+cache_dir = os.path.join('data', 'cache')
 
 
 np.random.seed(81)
 word2id, embedding_matrix, vocab = WordEmbeddingLoader(fp=os.path.join(
     'data', "glove.6B."+str(EmbeddingSize)+"d.txt"), embedding_size=EmbeddingSize)
+if PruneEmbedding:
+    word2id, embedding_matrix, vocab = prune_embedding(
+        word2id, embedding_matrix, corpus_vocabulary(train_fps + test_fps))
 with open(os.path.join('data', 'word2id.json'), 'w') as fout:
     json.dump(word2id, fp=fout)
 
 
 ids, post_texts, truth_classes, post_text_lens, truth_means, target_descriptions, target_description_lens, image_features = data_reader(
-    word2id=word2id, fps=[os.path.join('data', 'clickbait17-validation'), os.path.join('data', 'clickbait17-train-170331')], y_len=4, use_target_description=False, use_image=False)
+    word2id=word2id, fps=train_fps, y_len=4, use_target_description=False, use_image=False, cache_dir=cache_dir)
 post_texts = np.array(post_texts)
 truth_classes = np.array(truth_classes)
 post_text_lens = np.array(post_text_lens)
@@ -73,7 +90,7 @@ target_descriptions = Sequence_pader(
 
 
 tetids, tepost_texts, tetruth_classes, tepost_text_lens, tetruth_means, tetarget_descriptions, tetarget_description_lens, teimage_features = data_reader(
-    word2id=word2id, fps=[os.path.join('data', 'clickbait17-test')], y_len=4, use_target_description=False, use_image=False)
+    word2id=word2id, fps=test_fps, y_len=4, use_target_description=False, use_image=False, cache_dir=cache_dir)
 tepost_texts = np.array(tepost_texts)
 tetruth_classes = np.array(tetruth_classes)
 tepost_text_lens = [each_len if each_len <=
@@ -99,10 +116,14 @@ y_test = tetruth_means
 model = Sequential()
 
 
+# PAD (id 0) steps are masked, so the GRU output does not depend on how far
+# a post is padded: bucketed batches, the test matrix and test.py/serve.py
+# all pad to different lengths
 model.add(Embedding(input_dim=max_features,
                     output_dim=embedding_dims,
                     weights=[embedding_matrix],
-                    input_length=maxlen, trainable=False))
+                    input_length=None if BucketBatches else maxlen, trainable=False,
+                    mask_zero=True))
 model.add(Dropout(dropout_embedding))
 
 model.add(Bidirectional(GRU(512, dropout_W=0.2, dropout_U=0.5)))
@@ -114,41 +135,34 @@ model.compile(loss='mse',
 
 batch_size = 64
 
-earlystop_cb = keras.callbacks.EarlyStopping(
-    monitor='mse', patience=7, verbose=1, mode='auto')
+control, callbacks = training_callbacks(
+    patience=Patience, reduce_lr_patience=ReduceLRPatience)
 
-model.fit(X_train, y_train, batch_size=batch_size, nb_epoch=20,
-          validation_split=0.1, callbacks=[earlystop_cb])
+if BucketBatches:
+    train_batches, validation_batches = bucketed_train_and_validation(
+        X_train, post_text_lens, y_train, batch_size, validation_split=0.1, seed=81)
+    model.fit_generator(train_batches, epochs=20, validation_data=validation_batches,
+                        callbacks=callbacks)
+else:
+    model.fit(X_train, y_train, batch_size=batch_size, nb_epoch=20,
+              validation_split=0.1, callbacks=callbacks)
 
 petruth_means = model.predict(X_test)
-tetruthClass = []
-petruthClass = []
-
-
-for i in range(len(tetruth_means)):
-
-    if petruth_means[i] > 0.5:
-        petruthClass.append(1)
-    else:
-        petruthClass.append(0)
+measures = evaluate(tetruth_means, petruth_means, sweep_thresholds=True)
 
-    if tetruth_means[i] > 0.5:
-        tetruthClass.append(1)
-    else:
-        tetruthClass.append(0)
-
-
-mse = metrics.mean_squared_error(tetruth_means, petruth_means)
+mse = measures['mse']
 print('Mean Squared Error = '+str(mse))
 
-accuracy = metrics.accuracy_score(tetruthClass, petruthClass)
+accuracy = measures['accuracy']
 print('accuracy = '+str(accuracy))
 
-precision = metrics.precision_score(tetruthClass, petruthClass)
+precision = measures['precision']
 print('precision_score = '+str(precision))
 
-recall = metrics.recall_score(tetruthClass, petruthClass)
+recall = measures['recall']
 print('recall_score = '+str(recall))
 
-f1 = metrics.f1_score(tetruthClass, petruthClass)
+f1 = measures['f1']
 print('f1_score = '+str(f1))
+
+print('best f1_score = '+str(measures['best_f1'])+' at threshold '+str(measures['best_threshold']))
@@ -16,6 +16,8 @@ Created on Thu Apr 26 19:14:36 2018
 
 from __future__ import print_function
 
+import argparse
+import hashlib
 import json
 import os
 import pickle
@@ -33,6 +35,11 @@ from keras.models import Sequential
 from sklearn import metrics
 from sklearn.model_selection import KFold, train_test_split
 
+from evaluation import evaluate
+from sweep import (ResultStore, digest_files, expand_grid, fresh_session,
+                   halving_budgets, load_shared, run_sweep, share_arrays,
+                   successive_halving)
+from training import training_callbacks
 from tweet_utils import *
 from utils import *
 
@@ -43,146 +50,236 @@ PAD = "<pad>"
 UNK = "<unk>"
 nltk_tokeniser = nltk.tokenize.TweetTokenizer()
 
+train_fps = [os.path.join('data', 'clickbait17-validation'),
+             os.path.join('data', 'clickbait17-train-170331')]
+test_fps = [os.path.join('data', 'clickbait17-test')]
+cache_dir = os.path.join('data', 'cache')
+
+
+results_path = 'MyModelTraining2optimise.txt'
+grid = {'EmbeddingSize': [300, 200, 100, 50],
+        'dropout_embedding': [0.2, 0.5],
+        'dropout_W': [0.2, 0],
+        'dropout_U': [0.2, 0.3, 0.5],
+        'statesize': [128, 256]}
+max_epochs = 20
+# a result is reused only for the same hyperparameters, training control,
+# data, embedding, search mode and epoch budget, and only if it continued
+# from the same earlier budget (0 for a training from scratch): a halving
+# rung at 20 epochs resumed from 6 is not the same run as a grid job
+key_fields = ['statesize', 'EmbeddingSize', 'dropout_embedding', 'dropout_W', 'dropout_U',
+              'patience', 'reduce_lr_patience', 'data_hash', 'embedding_hash',
+              'search', 'resumed_from', 'budget']
+result_fields = key_fields + ['val_mse', 'mse', 'accuracy', 'precision', 'recall', 'f1',
+                              'epochs', 'epochs_saved', 'wall_time', 'peak_memory_mb']
+
+
+def prepare_data(EmbeddingSize, corpus_tokens):
+    # loads, prunes and tokenises once per embedding size and stores the
+    # arrays every job of that size memory-maps
+    np.random.seed(81)
+    word2id, embedding_matrix, vocab = WordEmbeddingLoader(fp=os.path.join(
+        'data', "glove.6B."+str(EmbeddingSize)+"d.txt"), embedding_size=EmbeddingSize)
+    word2id, embedding_matrix, vocab = prune_embedding(
+        word2id, embedding_matrix, corpus_tokens)
+    with open(os.path.join('data', 'word2id.json'), 'w') as fout:
+        json.dump(word2id, fp=fout)
+
+    ids, post_texts, truth_classes, post_text_lens, truth_means, target_descriptions, target_description_lens, image_features = data_reader(
+        word2id=word2id, fps=train_fps, y_len=4, use_target_description=False, use_image=False, workers=os.cpu_count(), cache_dir=cache_dir)
+    post_texts = np.array(post_texts)
+    truth_classes = np.array(truth_classes)
+    post_text_lens = np.array(post_text_lens)
+    truth_means = np.array(truth_means)
+    shuffle_indices = np.random.permutation(np.arange(len(post_texts)))
+    post_texts = post_texts[shuffle_indices]
+    truth_classes = truth_classes[shuffle_indices]
+    post_text_lens = post_text_lens[shuffle_indices]
+    truth_means = truth_means[shuffle_indices]
+    max_post_text_len = max(post_text_lens)
+
+    post_texts = Sequence_pader(post_texts, max_post_text_len)
+
+    tetids, tepost_texts, tetruth_classes, tepost_text_lens, tetruth_means, tetarget_descriptions, tetarget_description_lens, teimage_features = data_reader(
+        word2id=word2id, fps=test_fps, y_len=4, use_target_description=False, use_image=False, workers=os.cpu_count(), cache_dir=cache_dir)
+    tetruth_means = np.array(tetruth_means)
+    tetruth_means = np.ravel(tetruth_means).astype(np.float32)
+    tepost_texts = Sequence_pader(tepost_texts, max_post_text_len)
+
+    return share_arrays(os.path.join(cache_dir, 'sweep', str(EmbeddingSize)),
+                        embedding_matrix=embedding_matrix,
+                        X_train=post_texts, y_train=truth_means,
+                        X_test=tepost_texts, y_test=tetruth_means)
+
+
+def checkpoint_path(params, budget):
+    # weights of a configuration after budget epochs, for the next rung
+    key = ','.join(str(params[field]) for field in key_fields if field not in ('resumed_from', 'budget'))
+    return os.path.join(cache_dir, 'sweep', 'checkpoints',
+                        hashlib.sha1(key.encode('utf-8')).hexdigest() + '-' + str(budget) + '.npz')
+
+
+def train_and_evaluate(params, context):
+    # one sweep job: trains the BiGRU for params on the shared arrays up to
+    # params['budget'] epochs and returns its validation and test measures.
+    # With context['resume_from'] it continues from the weights a previous
+    # rung left after context['resume_epoch'] epochs, and with
+    # context['save_to'] it leaves its own for the next one.
+    data = load_shared(context['shared'])
+    embedding_matrix = data['embedding_matrix']
+    X_train = data['X_train']
+    y_train = data['y_train']
+    X_test = data['X_test']
+    y_test = data['y_test']
+
+    max_features, embedding_dims = embedding_matrix.shape
+    maxlen = X_train.shape[1]
+
+    epochs = params['budget']
+    batch_size = 64
+
+    fresh_session()
+    np.random.seed(81)
+
+    # build the keras LSTM model
+    model = Sequential()
+
+    model.add(Embedding(input_dim=max_features,
+                        output_dim=embedding_dims,
+                        weights=[np.asarray(embedding_matrix)],
+                        input_length=maxlen, trainable=False))
+    model.add(Dropout(params['dropout_embedding']))
+
+    # try using a GRU instead, for fun   #
+    model.add(Bidirectional(
+        GRU(params['statesize'], dropout_W=params['dropout_W'], dropout_U=params['dropout_U'])))
+
+    model.add(Dense(1))
+    model.add(Activation('sigmoid'))
+
+    # try using different optimizers and different optimizer configs
+    model.compile(loss='mse',
+                  optimizer='rmsprop')
+
+    print('Train...')
+    control, callbacks = training_callbacks(
+        patience=params['patience'], reduce_lr_patience=params['reduce_lr_patience'], verbose=0)
+
+    initial_epoch = 0
+    resume_from = context.get('resume_from')
+    if resume_from:
+        if not os.path.isfile(resume_from):
+            raise IOError("checkpoint {} of the previous rung is missing".format(resume_from))
+        # the frozen embedding is not in the checkpoint, and RMSprop starts
+        # its running averages afresh
+        with np.load(resume_from) as checkpoint:
+            model.set_weights([np.asarray(embedding_matrix)] +
+                              [checkpoint['arr_' + str(i)] for i in range(len(checkpoint.files))])
+        initial_epoch = context['resume_epoch']
+
+    model.fit(X_train, y_train, batch_size=batch_size, nb_epoch=epochs, initial_epoch=initial_epoch,
+              validation_split=0.1, callbacks=callbacks, verbose=0)
+
+    if context.get('save_to'):
+        os.makedirs(os.path.dirname(context['save_to']), exist_ok=True)
+        with open(context['save_to'] + '.tmp', 'wb') as fout:
+            np.savez(fout, *model.get_weights()[1:])
+        os.replace(context['save_to'] + '.tmp', context['save_to'])
+
+    measures = evaluate(y_test, model.predict(X_test))
+
+    summary = control.summary()
+    return {'val_mse': summary['best'],
+            'mse': measures['mse'], 'accuracy': measures['accuracy'], 'precision': measures['precision'],
+            'recall': measures['recall'], 'f1': measures['f1'],
+            'epochs': summary['epochs_run'], 'epochs_saved': summary['epochs_saved']}
 
-def main(argv=None):
-
-    with open('MyModelTraining2optimise.txt', "w") as myfile:
-        myfile.write(
-            'statesize,EmbeddingSize,dropout_embedding,dropout_W,dropout_U,mse, accuracy, precision, recall, f1 \n')
-
-    for EmbeddingSize in [300, 200, 100, 50]:
-
-        np.random.seed(81)
-        word2id, embedding_matrix, vocab = WordEmbeddingLoader(fp=os.path.join(
-            'data', "glove.6B."+str(EmbeddingSize)+"d.txt"), embedding_size=EmbeddingSize)
-        with open(os.path.join('data', 'word2id.json'), 'w') as fout:
-            json.dump(word2id, fp=fout)
-
-        ids, post_texts, truth_classes, post_text_lens, truth_means, target_descriptions, target_description_lens, image_features = data_reader(
-            word2id=word2id, fps=[os.path.join('data', 'clickbait17-validation'), os.path.join('data', 'clickbait17-train-170331')], y_len=4, use_target_description=False, use_image=False)
-        post_texts = np.array(post_texts)
-        truth_classes = np.array(truth_classes)
-        post_text_lens = np.array(post_text_lens)
-        truth_means = np.array(truth_means)
-        shuffle_indices = np.random.permutation(np.arange(len(post_texts)))
-        post_texts = post_texts[shuffle_indices]
-        truth_classes = truth_classes[shuffle_indices]
-        post_text_lens = post_text_lens[shuffle_indices]
-        truth_means = truth_means[shuffle_indices]
-        max_post_text_len = max(post_text_lens)
-
-        post_texts = Sequence_pader(post_texts, max_post_text_len)
-
-        target_descriptions = np.array(target_descriptions)
-        target_description_lens = np.array(target_description_lens)
-        target_descriptions = target_descriptions[shuffle_indices]
-        target_description_lens = target_description_lens[shuffle_indices]
-        max_target_description_len = max(target_description_lens)
-
-        target_descriptions = Sequence_pader(
-            target_descriptions, max_target_description_len)
-
-        tetids, tepost_texts, tetruth_classes, tepost_text_lens, tetruth_means, tetarget_descriptions, tetarget_description_lens, teimage_features = data_reader(
-            word2id=word2id, fps=[os.path.join('data', 'clickbait17-test')], y_len=4, use_target_description=False, use_image=False)
-        tepost_texts = np.array(tepost_texts)
-        tetruth_classes = np.array(tetruth_classes)
-        tepost_text_lens = [each_len if each_len <=
-                            max_post_text_len else max_post_text_len for each_len in tepost_text_lens]
-        tepost_text_lens = np.array(tepost_text_lens)
-        tetruth_means = np.array(tetruth_means)
-        tetruth_means = np.ravel(tetruth_means).astype(np.float32)
-        tepost_texts = Sequence_pader(tepost_texts, max_post_text_len)
-
-        max_features = len(word2id.keys())
-        maxlen = max_post_text_len
-        embedding_dims = EmbeddingSize
-
-        X_train = post_texts
-        y_train = truth_means
-
-        X_test = tepost_texts
-        y_test = tetruth_means
-
-        epochs = 20
-        batch_size = 64
-
-        for dropout_embedding in [0.2, 0.5]:
-            for dropout_W in [0.2, 0]:
-                for dropout_U in [0.2, 0.3, 0.5]:
-                    for statesize in [128, 256]:
-
-                        # build the keras LSTM model
-                        model = Sequential()
-
-                        # build the keras LSTM model
-
-                        model.add(Embedding(input_dim=max_features,
-                                            output_dim=embedding_dims,
-                                            weights=[embedding_matrix],
-                                            input_length=maxlen, trainable=False))
-                        model.add(Dropout(dropout_embedding))
-
-                        # try using a GRU instead, for fun   #
-                        model.add(Bidirectional(
-                            GRU(statesize, dropout_W=dropout_W, dropout_U=dropout_U)))
-
-                        model.add(Dense(1))
-                        model.add(Activation('sigmoid'))
-
-#                        model.summary()
-
-                        # try using different optimizers and different optimizer configs
-                        model.compile(loss='mse',
-                                      optimizer='rmsprop')
-
-                        print('Train...')
-                        earlystop_cb = keras.callbacks.EarlyStopping(
-                            monitor='mse', patience=7, verbose=1, mode='auto')
-
-                        model.fit(X_train, y_train, batch_size=batch_size, nb_epoch=epochs,
-                                  validation_split=0.1, callbacks=[earlystop_cb])
-                        # score, acc = model.evaluate(X_test, y_test,
-                        #                            batch_size=batch_size)
-
-                        petruth_means = model.predict(X_test)
-                        tetruthClass = []
-                        petruthClass = []
-
-                        for i in range(len(tetruth_means)):
-
-                            if petruth_means[i] > 0.5:
-                                petruthClass.append(1)
-                            else:
-                                petruthClass.append(0)
-
-                            if tetruth_means[i] > 0.5:
-                                tetruthClass.append(1)
-                            else:
-                                tetruthClass.append(0)
-
-                        mse = metrics.mean_squared_error(
-                            tetruth_means, petruth_means)
-                        print('Mean Squared Error = '+str(mse))
-
-                        accuracy = metrics.accuracy_score(
-                            tetruthClass, petruthClass)
-                        print('accuracy = '+str(accuracy))
-
-                        precision = metrics.precision_score(
-                            tetruthClass, petruthClass)
-                        #print('precision_score = '+str(precision))
-
-                        recall = metrics.recall_score(
-                            tetruthClass, petruthClass)
-                        #print('recall_score = '+str(recall))
-
-                        f1 = metrics.f1_score(tetruthClass, petruthClass)
-                        #print('f1_score = '+str(f1))
 
-                        with open('MyModelTraining2optimise.txt', "a") as myfile:
-                            myfile.write(str(statesize)+','+str(EmbeddingSize)+','+str(dropout_embedding)+','+str(dropout_W)+','+str(
-                                dropout_U)+','+str(mse)+','+str(accuracy) + ','+str(precision)+','+str(recall)+','+str(f1) + ' \n')
-#                        print(str(statesize)+','+str(EmbeddingSize)+','+str(dropout_embedding)+','+str(CNN_filters)+','+str(dropout_W)+','+str(dropout_U)+','+str(mse)+' \n')
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of configurations trained at the same time")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="TensorFlow/BLAS threads of each worker (default: an equal share of the cores)")
+    parser.add_argument('--results', default=results_path,
+                        help="CSV the results are appended to; configurations already in it are skipped")
+    parser.add_argument('--patience', type=int, default=7,
+                        help="Stop a training after this many epochs without a lower val_loss; the best epoch's weights are kept")
+    parser.add_argument('--reduce-lr-patience', type=int, default=0,
+                        help="Reduce the learning rate after this many epochs without a lower val_loss (0 never does)")
+    parser.add_argument('--search', choices=['grid', 'halving'], default='grid',
+                        help="Train every configuration for the full budget, or use successive halving")
+    parser.add_argument('--min-epochs', type=int, default=2,
+                        help="Epoch budget of the first successive halving rung")
+    parser.add_argument('--eta', type=int, default=3,
+                        help="Successive halving keeps the best 1/eta configurations and gives them eta times the epochs")
+    args = parser.parse_args(argv)
+
+    corpus_tokens = corpus_vocabulary(train_fps + test_fps)
+
+    shared = {}
+    hashes = {}
+    configs = []
+    for params in expand_grid(grid):
+        EmbeddingSize = params['EmbeddingSize']
+        if EmbeddingSize not in shared:
+            shared[EmbeddingSize] = prepare_data(EmbeddingSize, corpus_tokens)
+            hashes[EmbeddingSize] = {
+                'data_hash': digest_files([shared[EmbeddingSize][name] for name in ['X_train', 'y_train', 'X_test', 'y_test']]),
+                'embedding_hash': digest_files([shared[EmbeddingSize]['embedding_matrix']])}
+        configs.append(dict(params, patience=args.patience, reduce_lr_patience=args.reduce_lr_patience,
+                            search=args.search, **hashes[EmbeddingSize]))
+
+    if args.search == 'halving':
+        budgets = halving_budgets(args.min_epochs, max_epochs, args.eta)
+    else:
+        budgets = [max_epochs]
+
+    with ResultStore(args.results, result_fields, key_fields) as store:
+
+        def run_rung(rung_configs, budget, previous_budget):
+            results = []
+            jobs = []
+            for params in rung_configs:
+                params = dict(params, resumed_from=previous_budget or 0, budget=budget)
+                stored = store.get(params)
+                if stored is not None:
+                    results.append((params, stored))
+                    continue
+                context = {'shared': shared[params['EmbeddingSize']]}
+                if previous_budget:
+                    context['resume_from'] = checkpoint_path(params, previous_budget)
+                    context['resume_epoch'] = previous_budget
+                    if not os.path.isfile(context['resume_from']):
+                        # the previous rung's row was reused from the store but
+                        # its weights are gone; training from scratch would be
+                        # stored and ranked as a resumed run
+                        raise IOError("{} has a {}-epoch result in {} but no checkpoint {}; remove its rows "
+                                      "for this search from the results or restore the checkpoints".format(
+                                          params, previous_budget, args.results, context['resume_from']))
+                if budget != budgets[-1]:
+                    context['save_to'] = checkpoint_path(params, budget)
+                jobs.append((params, context))
+            print('{} epochs: {} of {} configurations already in {}, running {}'.format(
+                budget, len(results), len(rung_configs), args.results, len(jobs)))
+
+            for params, result, cost in run_sweep(train_and_evaluate, jobs, workers=args.workers,
+                                                  threads_per_worker=args.threads_per_worker):
+                print('{} val_mse = {} mse = {} accuracy = {} ({} epochs, {} saved, {:.0f}s)'.format(
+                    params, result['val_mse'], result['mse'], result['accuracy'], result['epochs'],
+                    result['epochs_saved'], cost['wall_time']))
+                row = dict(params, **dict(result, **cost))
+                store.append(row)
+                results.append((params, row))
+            return results
+
+        for budget, ranked in successive_halving(run_rung, configs, budgets, eta=args.eta):
+            params, result = ranked[0]
+            print('Best after {} epochs: {} val_mse = {} mse = {}'.format(
+                budget, params, result['val_mse'], result['mse']))
+            print('{} of {} planned epochs saved by early stopping'.format(
+                sum(int(row['epochs_saved']) for _, row in ranked),
+                sum(int(row['epochs']) + int(row['epochs_saved']) for _, row in ranked)))
 
 
 if __name__ == "__main__":
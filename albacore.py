@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+from keras.layers import GRU, Activation, Bidirectional, Dense, Dropout, Embedding
+from keras.models import Sequential
+
+from utils import Sequence_pader, texts_to_ids
+
+MAX_POST_TEXT_LEN = 42
+EMBEDDING_SIZE = 100
+
+
+def build_albacore_model(max_features, maxlen=MAX_POST_TEXT_LEN, embedding_dims=EMBEDDING_SIZE, dropout_embedding=0.2):
+    # the BiGRU(512) scorer weights_albacore.hdf5 was trained for
+    model = Sequential()
+
+    model.add(Embedding(input_dim=max_features,
+                        output_dim=embedding_dims,
+                        input_length=maxlen, trainable=True))
+    model.add(Dropout(dropout_embedding))
+
+    model.add(Bidirectional(GRU(512, dropout_W=0.2, dropout_U=0.5)))
+    model.add(Dense(1))
+    model.add(Activation('sigmoid'))
+
+    model.compile(loss='mse',
+                  optimizer='rmsprop')
+    return model
+
+
+def load_albacore(word2id_path='word2id.json', weights_path='weights_albacore.hdf5', maxlen=MAX_POST_TEXT_LEN):
+    with open(word2id_path, 'r') as fin:
+        word2id = json.load(fin)
+    model = build_albacore_model(len(word2id), maxlen=maxlen)
+    model.load_weights(weights_path)
+    return model, word2id
+
+
+def posts_to_ids(post_texts, word2id):
+    # postText lists (or plain strings) to id sequences, as data_reader does
+    return texts_to_ids([each_post_text if isinstance(each_post_text, str) else " ".join(each_post_text)
+                         for each_post_text in post_texts], word2id)[0]
+
+
+def predict_scores(model, sequences, maxlen=MAX_POST_TEXT_LEN, batch_size=256):
+    if not len(sequences):
+        return np.zeros(0, dtype=np.float32)
+    return np.ravel(model.predict(Sequence_pader(sequences, maxlen), batch_size=batch_size))
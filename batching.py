@@ -0,0 +1,47 @@
+import keras.utils
+import numpy as np
+
+
+class BucketedSequence(keras.utils.Sequence):
+    # Feeds post-padded id matrices to fit_generator in batches of similar
+    # length, each cut down to its own longest sequence so the recurrent
+    # layers skip the trailing PAD timesteps. Every epoch the examples are
+    # reshuffled before the stable sort by length, so batches are composed
+    # differently, and the batch order is shuffled as well.
+
+    def __init__(self, x, lens, y, batch_size, shuffle=True, seed=None):
+        self.x = x
+        self.lens = np.minimum(np.asarray(lens), x.shape[1])
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.random_state = np.random.RandomState(seed)
+        self.batches = []
+        self.on_epoch_end()
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, idx):
+        batch = self.batches[idx]
+        maxlen = max(int(self.lens[batch].max()), 1)
+        return self.x[batch, :maxlen], self.y[batch]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            order = self.random_state.permutation(len(self.lens))
+        else:
+            order = np.arange(len(self.lens))
+        order = order[np.argsort(self.lens[order], kind='stable')]
+        self.batches = [np.sort(order[i:i+self.batch_size])
+                        for i in range(0, len(order), self.batch_size)]
+        if self.shuffle:
+            self.random_state.shuffle(self.batches)
+
+
+def bucketed_train_and_validation(x, lens, y, batch_size, validation_split=0.1, seed=None):
+    # the same split keras' fit(validation_split=...) makes: the last
+    # fraction of the examples, taken before any shuffling
+    split_at = int(len(x) * (1. - validation_split))
+    return (BucketedSequence(x[:split_at], lens[:split_at], y[:split_at], batch_size, seed=seed),
+            BucketedSequence(x[split_at:], lens[split_at:], y[split_at:], batch_size, shuffle=False))
@@ -0,0 +1,34 @@
+import argparse
+import os
+import tempfile
+
+from caption import caption_image
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--data-folder', help="Folder containing the images we want to caption")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(),
+                        help="Largest number of worker processes to try")
+    parser.add_argument('--limit', type=int, default=256,
+                        help="Number of images captioned per run")
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help="Number of images whose beam searches share each decoding step")
+    args = parser.parse_args()
+
+    workers = 1
+    results = []
+    while workers <= args.max_workers:
+        # a fresh store per run, so no run skips images captioned by another
+        with tempfile.TemporaryDirectory() as store_folder:
+            count, images_per_second = caption_image(
+                args.data_folder, os.path.join(store_folder, 'captions.jsonl'), batch_size=args.batch_size,
+                workers=workers, limit=args.limit)
+        results.append((workers, images_per_second))
+        workers *= 2
+
+    print("{:>8} {:>12} {:>8}".format('workers', 'images/s', 'speedup'))
+    for workers, images_per_second in results:
+        print("{:>8} {:>12.2f} {:>7.2f}x".format(
+            workers, images_per_second, images_per_second / results[0][1] if results[0][1] else 0.0))
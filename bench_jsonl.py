@@ -0,0 +1,56 @@
+import argparse
+import json
+import timeit
+from os.path import join
+
+import jsonl
+from utils import INSTANCE_FIELDS
+
+TRUTH_FIELDS = ('id', 'truthClass', 'truthMean', 'truthJudgments')
+
+
+def stdlib_ingest(data_folders):
+    # what data_reader did before: decode bytes to str, then json.loads
+    items = 0
+    for data_folder in data_folders:
+        for name in ['truth.jsonl', 'instances.jsonl']:
+            with open(join(data_folder, name), 'rb') as fin:
+                for each_line in fin:
+                    json.loads(each_line.decode('utf-8'))
+                    items += 1
+    return items
+
+
+def jsonl_ingest(data_folders, backend):
+    items = 0
+    for data_folder in data_folders:
+        for name, fields in [('truth.jsonl', TRUTH_FIELDS), ('instances.jsonl', INSTANCE_FIELDS)]:
+            for _ in jsonl.read_jsonl(join(data_folder, name), fields=fields, backend=backend):
+                items += 1
+    return items
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-folders', nargs='+', default=[join('data', 'clickbait17-validation'), join('data', 'clickbait17-train-170331')],
+                        help="Folders containing the instances.jsonl and truth.jsonl to decode")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of timed runs, the best one is reported")
+    args = parser.parse_args()
+
+    runs = [('json.loads, all fields', lambda: stdlib_ingest(args.data_folders))]
+    for backend, module in [('json', json), ('orjson', jsonl.orjson), ('msgspec', jsonl.msgspec)]:
+        if module is None:
+            print("{} is not installed, skipping".format(backend))
+            continue
+        runs.append(('jsonl[{}], selected fields'.format(backend),
+                     lambda backend=backend: jsonl_ingest(args.data_folders, backend)))
+
+    print("Default backend: {}".format(jsonl.BACKEND))
+    baseline = None
+    for name, run in runs:
+        items = run()
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print("{:<36} {:8.3f}s {:10.0f} lines/s {:6.2f}x".format(
+            name, best, items / best, baseline / best))
@@ -0,0 +1,44 @@
+import argparse
+import timeit
+from json import loads
+from os.path import join
+
+from utils import TWEET_NORMALIZER, tweet_processor
+
+
+def read_texts(data_folders):
+    texts = []
+    for data_folder in data_folders:
+        with open(join(data_folder, 'instances.jsonl'), 'r', encoding="utf8") as instances_file:
+            for line in instances_file:
+                line_as_dict = loads(line)
+                texts.append(" ".join(line_as_dict["postText"]))
+                texts.append(line_as_dict["targetTitle"])
+    return texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-folders', nargs='+', default=[join('data', 'clickbait17-validation'), join('data', 'clickbait17-train-170331')],
+                        help="Folders containing the instances.jsonl to normalise")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of timed runs, the best one is reported")
+    args = parser.parse_args()
+
+    texts = read_texts(args.data_folders)
+    expected = [tweet_processor(text) for text in texts]
+    assert TWEET_NORMALIZER.normalize_batch(texts) == expected
+    assert [TWEET_NORMALIZER.normalize(text) for text in texts] == expected
+
+    timings = {
+        'tweet_processor': lambda: [tweet_processor(text) for text in texts],
+        'TweetNormalizer.normalize': lambda: [TWEET_NORMALIZER.normalize(text) for text in texts],
+        'TweetNormalizer.normalize_batch': lambda: TWEET_NORMALIZER.normalize_batch(texts),
+    }
+    print("Texts: {}".format(len(texts)))
+    baseline = None
+    for name, run in timings.items():
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print("{:<32} {:8.3f}s {:10.0f} texts/s {:6.2f}x".format(
+            name, best, len(texts) / best, baseline / best))
@@ -1,8 +1,10 @@
 import argparse
+import json
+import math
+import multiprocessing
 import os
-import re
+import time
 import numpy as np
-from json import loads
 from os.path import isdir, join
 import tensorflow as tf
 from im2txt import configuration
@@ -11,16 +13,171 @@ from im2txt.inference_utils import caption_generator
 from im2txt.inference_utils import vocabulary
 from tqdm import tqdm
 
+from jsonl import decoder, read_jsonl
+from utils import load_image_features, read_ahead
+
 checkpoint_path = 'Pretrained-Show-and-Tell-model/model.ckpt-2000000'
 vocab_file = 'Pretrained-Show-and-Tell-model/word_counts.txt'
 
-def caption_image(data_folder, output_folder):
-    id_folder = join(data_folder.split("m")[0], "instances.jsonl")
-    images = []
-    ids_dict = {}
-    for file in os.listdir(data_folder):
-        images.append(join(data_folder, file))
+def index_media(instances_path):
+    # media file name -> id of the instance that posted it, for every entry
+    # of every postMedia list
+    media_to_id = {}
+    for instance in read_jsonl(instances_path, fields=('id', 'postMedia')):
+        for media_path in instance["postMedia"]:
+            media_to_id[os.path.basename(media_path)] = instance["id"]
+    return media_to_id
+
+
+def read_images_ahead(filenames, prefetch=64, skip=frozenset()):
+    # yields (filename, encoded image) while a producer thread keeps reading
+    # up to prefetch files ahead of the model; files in skip are not read
+    # and come with None. A file that cannot be read raises here.
+    def read_images():
+        for filename in filenames:
+            if filename in skip:
+                yield filename, None
+                continue
+            with tf.gfile.GFile(filename, "rb") as f:
+                yield filename, f.read()
+
+    return read_ahead(read_images(), depth=prefetch)
+
+
+def batches_of(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def batch_beam_search(sess, model, vocab, encoded_images, beam_size=3, max_caption_length=20,
+                      length_normalization_factor=0.0, initial_states=None):
+    # CaptionGenerator.beam_search for several images at once: the partial
+    # captions of all images are stacked so every decoding step is a single
+    # inference_step call. The image graph only takes one image per feed, so
+    # the Inception pass still runs image by image, unless initial_states
+    # already holds an image's initial LSTM state (see image_features.py).
+    Caption, TopN = caption_generator.Caption, caption_generator.TopN
+    partial_captions = []
+    complete_captions = []
+    if initial_states is None:
+        initial_states = [None] * len(encoded_images)
+    for encoded_image, initial_state in zip(encoded_images, initial_states):
+        if initial_state is None:
+            initial_state = model.feed_image(sess, encoded_image)[0]
+        partial = TopN(beam_size)
+        partial.push(Caption(sentence=[vocab.start_id], state=initial_state,
+                             logprob=0.0, score=0.0, metadata=[""]))
+        partial_captions.append(partial)
+        complete_captions.append(TopN(beam_size))
+
+    for _ in range(max_caption_length - 1):
+        partial_lists = []
+        for partial in partial_captions:
+            partial_lists.append(partial.extract())
+            partial.reset()
+        flat = [c for partial_list in partial_lists for c in partial_list]
+        if not flat:
+            break
+        input_feed = np.array([c.sentence[-1] for c in flat])
+        state_feed = np.array([c.state for c in flat])
+        softmax, new_states, metadata = model.inference_step(sess, input_feed, state_feed)
+
+        row = 0
+        for image_index, partial_list in enumerate(partial_lists):
+            for partial_caption in partial_list:
+                word_probabilities = softmax[row]
+                state = new_states[row]
+                # same order as sorting (word, p) pairs by -p, ties by word id
+                top_words = np.argsort(-word_probabilities, kind='stable')[:beam_size]
+                for w in top_words:
+                    p = word_probabilities[w]
+                    if p < 1e-12:
+                        continue  # Avoid log(0).
+                    sentence = partial_caption.sentence + [int(w)]
+                    logprob = partial_caption.logprob + math.log(p)
+                    score = logprob
+                    if metadata:
+                        metadata_list = partial_caption.metadata + [metadata[row]]
+                    else:
+                        metadata_list = None
+                    if w == vocab.end_id:
+                        if length_normalization_factor > 0:
+                            score /= len(sentence)**length_normalization_factor
+                        complete_captions[image_index].push(
+                            Caption(sentence, state, logprob, score, metadata_list))
+                    else:
+                        partial_captions[image_index].push(
+                            Caption(sentence, state, logprob, score, metadata_list))
+                row += 1
+
+    results = []
+    for partial, complete in zip(partial_captions, complete_captions):
+        # If we have no complete captions then fall back to the partial captions.
+        if not complete.size():
+            complete = partial
+        results.append(complete.extract(sort=True))
+    return results
+
+
+def read_caption_store(store_path):
+    # file names of the images already captioned in the JSONL store; a line
+    # cut short by an interrupted run is ignored and that image redone
+    captioned = set()
+    if not os.path.isfile(store_path):
+        return captioned
+    decode = decoder(('image',))
+    with open(store_path, 'rb') as store_file:
+        for line in store_file:
+            try:
+                captioned.add(decode(line)['image'])
+            except (ValueError, KeyError):
+                continue
+    return captioned
+
 
+def open_caption_store(store_path):
+    # start on a fresh line if the last run died in the middle of one
+    needs_newline = False
+    if os.path.isfile(store_path) and os.path.getsize(store_path):
+        with open(store_path, 'rb') as store_file:
+            store_file.seek(-1, os.SEEK_END)
+            needs_newline = store_file.read(1) != b'\n'
+    store_file = open(store_path, 'a', encoding="utf8")
+    if needs_newline:
+        store_file.write('\n')
+    return store_file
+
+
+def shard_store_path(store_path, shard):
+    return "{}.shard{}".format(store_path, shard)
+
+
+def merge_shard_stores(store_path):
+    # appends what the shard workers wrote (including shards left behind by
+    # an interrupted run) to the main store and removes the shard files
+    folder = os.path.dirname(os.path.abspath(store_path))
+    prefix = os.path.basename(store_path) + ".shard"
+    shard_paths = sorted(join(folder, name) for name in os.listdir(folder)
+                         if name.startswith(prefix))
+    if not shard_paths:
+        return
+    with open_caption_store(store_path) as store_file:
+        for shard_path in shard_paths:
+            with open(shard_path, 'r', encoding="utf8") as shard_file:
+                for line in shard_file:
+                    if line.endswith('\n'):
+                        store_file.write(line)
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+
+
+def build_inference_graph():
     # Build the inference graph.
     g = tf.Graph()
     with g.as_default():
@@ -28,47 +185,108 @@ def caption_image(data_folder, output_folder):
       restore_fn = model.build_graph_from_config(configuration.ModelConfig(),
                                              checkpoint_path)
     g.finalize()
+    return g, model, restore_fn
+
+
+def session_config(intra_op_threads=0, inter_op_threads=0):
+    # 0 lets TensorFlow use every core, which is right for a single process
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads)
+
+
+def caption_shard(images, media_to_id, store_path, batch_size=16, beam_size=3, max_caption_length=20, prefetch=64,
+                  intra_op_threads=0, inter_op_threads=0, show_progress=True, features_folder=None):
+    g, model, restore_fn = build_inference_graph()
 
     # Create the vocabulary.
     vocab = vocabulary.Vocabulary(vocab_file)
 
-    with tf.Session(graph=g) as sess:
+    # images whose initial state image_features.py already cached skip the
+    # Inception pass and are not read from disk at all
+    image2idx, features = {}, None
+    if features_folder and os.path.isfile(join(features_folder, "image_features.npy")):
+        _, image2idx, features = load_image_features(features_folder)
+    cached = set(filename for filename in images if os.path.basename(filename) in image2idx)
+
+    with tf.Session(graph=g, config=session_config(intra_op_threads, inter_op_threads)) as sess, \
+            open_caption_store(store_path) as store_file:
         # Load the model from checkpoint.
         restore_fn(sess)
 
-        # Prepare the caption generator. Here we are implicitly using the default
-        # beam search parameters. See caption_generator.py for a description of the
-        # available beam search parameters.
-        generator = caption_generator.CaptionGenerator(model, vocab)
+        progress = tqdm(total=len(images), disable=not show_progress)
+        for batch in batches_of(read_images_ahead(images, prefetch=prefetch, skip=cached), batch_size):
+            initial_states = [np.asarray(features[image2idx[os.path.basename(filename)]], dtype=np.float32)
+                              if filename in cached else None for filename, _ in batch]
+            batch_captions = batch_beam_search(sess, model, vocab, [image for _, image in batch],
+                                               beam_size=beam_size, max_caption_length=max_caption_length,
+                                               initial_states=initial_states)
+            for (filename, _), captions in zip(batch, batch_captions):
+                # Just take the first caption and display it
+                caption = captions[0]
+                sentence = [vocab.id_to_word(w) for w in caption.sentence[1:-1]]
+                sentence = " ".join(sentence)
 
-        for filename in tqdm(images):
-            with tf.gfile.GFile(filename, "rb") as f:
-                image = f.read()
-            captions = generator.beam_search(sess, image)
-
-            # Just take the first caption and display it
-            caption = captions[0]
-            sentence = [vocab.id_to_word(w) for w in caption.sentence[1:-1]]
-            sentence = " ".join(sentence)
-
-            with open(id_folder, 'r', encoding='utf8') as instances:
-                for instance in instances:
-                    instance = loads(instance)
-                    photo_name = re.split("[_']", str(instance["postMedia"]))
-
-                    if len(photo_name) == 7:
-                        if photo_name[2] == filename.split("_")[1]:
-                            ids_dict[sentence] = instance["id"]
-                        if photo_name[5] == filename.split("_")[1]:
-                            ids_dict[sentence] = instance["id"]
-                    elif len(photo_name) == 4:
-                        if photo_name[2] == filename.split("_")[1]:
-                            ids_dict[sentence] = instance["id"]
-                    else:
-                        continue
+                image_file = os.path.basename(filename)
+                store_file.write(json.dumps({"image": image_file, "id": media_to_id[image_file],
+                                             "caption": sentence}) + '\n')
+            store_file.flush()
+            progress.update(len(batch))
+        progress.close()
+    return len(images)
+
+
+def _caption_shard_worker(args):
+    shard, images, media_to_id, store_path, options = args
+    return caption_shard(images, media_to_id, shard_store_path(store_path, shard),
+                         show_progress=shard == 0, **options)
+
+
+def caption_image(data_folder, output_folder, batch_size=16, beam_size=3, max_caption_length=20, prefetch=64,
+                  workers=1, limit=None):
+    # With workers > 1 the images are split round-robin over that many
+    # processes, each loading the checkpoint once and writing its own shard
+    # store, and the shards are merged into output_folder at the end.
+    # Returns the number of images captioned and the images/s reached.
+    id_folder = join(os.path.dirname(os.path.normpath(data_folder)), "instances.jsonl")
+    media_to_id = index_media(id_folder)
+    merge_shard_stores(output_folder)
+    captioned = read_caption_store(output_folder)
+    images = []
+    for file in sorted(os.listdir(data_folder)):
+        # images no instance refers to would be captioned for nothing, and
+        # images already in the store are not captioned again
+        if file in media_to_id and file not in captioned:
+            images.append(join(data_folder, file))
+    images = images[:limit]
+    print("Captioning {} images, {} already in {}".format(
+        len(images), len(captioned), output_folder))
 
-    with open(output_folder, 'w', encoding="utf8") as output_file:
-        output_file.write(str(ids_dict))
+    options = dict(batch_size=batch_size, beam_size=beam_size,
+                   max_caption_length=max_caption_length, prefetch=prefetch,
+                   features_folder=os.path.dirname(os.path.normpath(data_folder)))
+    start = time.time()
+    if workers <= 1:
+        caption_shard(images, media_to_id, output_folder, **options)
+    else:
+        # split the cores between the workers instead of letting every
+        # session size its thread pools for the whole machine
+        options['intra_op_threads'] = max(1, multiprocessing.cpu_count() // workers)
+        options['inter_op_threads'] = 1
+        shards = []
+        for shard in range(workers):
+            shard_images = images[shard::workers]
+            shard_media_to_id = {os.path.basename(filename): media_to_id[os.path.basename(filename)]
+                                 for filename in shard_images}
+            shards.append((shard, shard_images, shard_media_to_id, output_folder, options))
+        # spawn, so no worker inherits TensorFlow state from the parent
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            pool.map(_caption_shard_worker, shards)
+        merge_shard_stores(output_folder)
+    elapsed = time.time() - start
+    images_per_second = len(images) / elapsed if elapsed else 0.0
+    print("Captioned {} images in {:.1f}s with {} worker(s) ({:.2f} images/s)".format(
+        len(images), elapsed, workers, images_per_second))
+    return len(images), images_per_second
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -76,7 +294,18 @@ if __name__ == "__main__":
         '--data-folder', help="Folder containing the images we want to caption")
  
     parser.add_argument('--output-folder',
-                        help="Folder containing the captions")
+                        help="JSONL file the captions are appended to; images already in it are skipped")
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help="Number of images whose beam searches share each decoding step")
+    parser.add_argument('--beam-size', type=int, default=3,
+                        help="Beam width of the caption search")
+    parser.add_argument('--max-caption-length', type=int, default=20,
+                        help="Maximum number of words in a caption")
+    parser.add_argument('--prefetch', type=int, default=64,
+                        help="Number of images read ahead of the model")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes the images are sharded over")
     args = parser.parse_args()
 
-    caption_image(args.data_folder, args.output_folder)
+    caption_image(args.data_folder, args.output_folder, batch_size=args.batch_size, beam_size=args.beam_size,
+                  max_caption_length=args.max_caption_length, prefetch=args.prefetch, workers=args.workers)
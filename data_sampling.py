@@ -1,20 +1,33 @@
 import argparse
-from json import loads
-from os import listdir, mkdir
-from os.path import isdir, join
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import link, mkdir, remove, stat, symlink
+from os.path import abspath, isdir, isfile, join, lexists
 from shutil import copy
 
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
 import numpy as np
 
 from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 
+from jsonl import decoder
+
+MEDIA_MODES = ['copy', 'hardlink', 'reflink', 'symlink']
+# ioctl request number of Linux' FICLONE
+FICLONE = 0x40049409
+
 
 def read_and_split_data(data_folder):
     truths_file_path = join(data_folder, 'truth.jsonl')
 
+    decode = decoder(('id', 'truthClass'))
+
     def get_id_and_class(truth_row):
-        truth_row = loads(truth_row)
+        truth_row = decode(truth_row)
         return [truth_row['id'], truth_row['truthClass']]
 
     with open(truths_file_path, 'r') as truths_file:
@@ -26,10 +39,10 @@ def read_and_split_data(data_folder):
     train_ids, test_ids, _, _ = train_test_split(
         ids, classes, test_size=0.3, random_state=42, stratify=classes)
 
-    return list(train_ids), list(test_ids)
+    return set(train_ids), set(test_ids)
 
 
-def split_and_store_data(train_ids, test_ids, data_folder, output_train_folder, output_test_folder):
+def split_and_store_data(train_ids, test_ids, data_folder, output_train_folder, output_test_folder, media_mode='copy', media_workers=8):
     input_instances_file_path = join(data_folder, 'instances.jsonl')
     input_truths_file_path = join(data_folder, 'truth.jsonl')
 
@@ -43,48 +56,49 @@ def split_and_store_data(train_ids, test_ids, data_folder, output_train_folder,
         output_train_folder, 'instances.jsonl')
     output_test_instances_file_path = join(
         output_test_folder, 'instances.jsonl')
+    output_train_truths_file_path = join(output_train_folder, 'truth.jsonl')
+    output_test_truths_file_path = join(output_test_folder, 'truth.jsonl')
 
-    train_image_ids, test_image_ids, ignore_ids = get_image_ids(input_instances_file_path, train_ids, test_ids)
+    train_ids, test_ids = set(train_ids), set(test_ids)
+    train_image_ids, test_image_ids, ignore_ids = store_split_instances(
+        train_ids, test_ids, input_instances_file_path,
+        output_train_instances_file_path, output_test_instances_file_path)
 
     print("Number of training images: {}".format(len(train_image_ids)))
     print("Number of testing images: {}".format(len(test_image_ids)))
 
-    split_and_store_images(train_image_ids, test_image_ids, data_folder, output_train_folder, output_test_folder)
+    split_and_store_images(train_image_ids, test_image_ids, data_folder, output_train_folder, output_test_folder,
+                           mode=media_mode, workers=media_workers)
 
-    output_train_truths_file_path = join(output_train_folder, 'truth.jsonl')
-    output_test_truths_file_path = join(output_test_folder, 'truth.jsonl')
-
-    store_sampled_data(train_ids, input_instances_file_path,
-                       output_train_instances_file_path, ignore_ids=ignore_ids)
-    store_sampled_data(train_ids, input_truths_file_path,
-                       output_train_truths_file_path, ignore_ids=ignore_ids)
+    store_split_data(train_ids, test_ids, input_truths_file_path,
+                     output_train_truths_file_path, output_test_truths_file_path, ignore_ids=ignore_ids)
 
-    store_sampled_data(test_ids, input_instances_file_path,
-                       output_test_instances_file_path, ignore_ids=ignore_ids)
-    store_sampled_data(test_ids, input_truths_file_path,
-                       output_test_truths_file_path, ignore_ids=ignore_ids)
 
-def get_image_ids(instances_path, train_ids, test_ids):
+def store_split_instances(train_ids, test_ids, input_path, output_train_path, output_test_path):
+    # One pass over instances.jsonl: instances without media are ignored,
+    # the rest are written to the train or test output and their image
+    # file names collected.
     train_image_ids, test_image_ids = [], []
-    ignore_ids = []
-    with open(instances_path, 'r', encoding="utf8") as instances_file:
-        for line in instances_file:
-            line_as_dict = loads(line)
+    ignore_ids = set()
+    decode = decoder(('id', 'postMedia'))
+    with open(input_path, 'r', encoding="utf8") as input_file, \
+            open(output_train_path, 'w', encoding="utf8") as output_train_file, \
+            open(output_test_path, 'w', encoding="utf8") as output_test_file:
+        for line in input_file:
+            line_as_dict = decode(line)
             image_ids = line_as_dict["postMedia"]
-            if image_ids:
-                if line_as_dict['id'] in train_ids:
-                    for image_id in image_ids:
-                        train_image_ids.append(image_id.split('/')[1])
-                elif line_as_dict['id'] in test_ids:
-                    for image_id in image_ids:
-                        test_image_ids.append(image_id.split('/')[1])
-                else:
-                    continue
-            else:
-                ignore_ids.append(line_as_dict['id'])
+            if not image_ids:
+                ignore_ids.add(line_as_dict['id'])
+            elif line_as_dict['id'] in train_ids:
+                output_train_file.write(line)
+                train_image_ids.extend(image_id.split('/')[1] for image_id in image_ids)
+            elif line_as_dict['id'] in test_ids:
+                output_test_file.write(line)
+                test_image_ids.extend(image_id.split('/')[1] for image_id in image_ids)
     return train_image_ids, test_image_ids, ignore_ids
 
-def split_and_store_images(train_ids, test_ids, data_folder, output_train_folder, output_test_folder):
+
+def split_and_store_images(train_ids, test_ids, data_folder, output_train_folder, output_test_folder, mode='copy', workers=8):
     input_images_folder = join(data_folder, 'media')
     output_train_images_folder = join(output_train_folder, 'media')
     output_test_images_folder = join(output_test_folder, 'media')
@@ -96,25 +110,77 @@ def split_and_store_images(train_ids, test_ids, data_folder, output_train_folder
         mkdir(output_test_images_folder)
 
     store_sampled_images(train_ids, input_images_folder,
-                         output_train_images_folder)
+                         output_train_images_folder, mode=mode, workers=workers)
     store_sampled_images(test_ids, input_images_folder,
-                         output_test_images_folder)
+                         output_test_images_folder, mode=mode, workers=workers)
 
 
-def store_sampled_data(ids, input_path, output_path, ignore_ids=[]):
-    with open(input_path, 'r', encoding="utf8") as input_file, open(output_path, 'w', encoding="utf8") as output_file:
+def store_split_data(train_ids, test_ids, input_path, output_train_path, output_test_path, ignore_ids=frozenset()):
+    decode = decoder(('id',))
+    with open(input_path, 'r', encoding="utf8") as input_file, \
+            open(output_train_path, 'w', encoding="utf8") as output_train_file, \
+            open(output_test_path, 'w', encoding="utf8") as output_test_file:
         for line in input_file:
-            line_as_dict = loads(line)
-            if line_as_dict['id'] in ids and not line_as_dict['id'] in ignore_ids:
-                output_file.write(line)
-
-
-def store_sampled_images(ids, input_folder, output_folder):
-    for image_file in tqdm(listdir(input_folder), desc="Storing images"):
-        if image_file in ids:
-            src = join(input_folder, image_file)
-            dest = join(output_folder, image_file)
-            copy(src, dest)
+            line_id = decode(line)['id']
+            if line_id in ignore_ids:
+                continue
+            if line_id in train_ids:
+                output_train_file.write(line)
+            elif line_id in test_ids:
+                output_test_file.write(line)
+
+
+def store_sampled_images(ids, input_folder, output_folder, mode='copy', workers=8):
+    # Materialises only the wanted images, on a thread pool. Images that are
+    # listed in the manifest next to output_folder, or already exist there
+    # with the source's size, are skipped, so an interrupted split resumes
+    # where it stopped. Ids without a source file are skipped as before.
+    manifest_path = output_folder.rstrip('/\\') + '.manifest'
+    done = set()
+    if isfile(manifest_path):
+        with open(manifest_path, 'r', encoding="utf8") as manifest_file:
+            done = set(line.rstrip('\n') for line in manifest_file)
+    pending = [image_file for image_file in sorted(set(ids))
+               if image_file not in done or not lexists(join(output_folder, image_file))]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(manifest_path, 'a', encoding="utf8") as manifest_file:
+        futures = {pool.submit(materialise_image, join(input_folder, image_file), join(output_folder, image_file), mode): image_file
+                   for image_file in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Storing images"):
+            if future.result():
+                manifest_file.write(futures[future] + '\n')
+
+
+def materialise_image(src, dest, mode='copy'):
+    # returns False when there is no source file to materialise
+    try:
+        src_size = stat(src).st_size
+    except FileNotFoundError:
+        return False
+    if lexists(dest):
+        if isfile(dest) and stat(dest).st_size == src_size:
+            return True
+        remove(dest)
+
+    if mode == 'symlink':
+        symlink(abspath(src), dest)
+        return True
+    if mode == 'hardlink':
+        try:
+            link(src, dest)
+            return True
+        except OSError:
+            # e.g. source and destination are on different filesystems
+            pass
+    if mode == 'reflink' and ioctl is not None:
+        try:
+            with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+                ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+            return True
+        except OSError:
+            remove(dest)
+    copy(src, dest)
+    return True
 
 
 if __name__ == "__main__":
@@ -125,8 +191,13 @@ if __name__ == "__main__":
                         help="Folder containing training data we acquired by sampling")
     parser.add_argument('--output-test-folder',
                         help="Folder containing test data we acquired by sampling")
+    parser.add_argument('--media-mode', choices=MEDIA_MODES, default='copy',
+                        help="How images are materialised; hardlink and reflink fall back to copy across filesystems")
+    parser.add_argument('--media-workers', type=int, default=8,
+                        help="Number of threads materialising images")
     args = parser.parse_args()
 
     train_ids, test_ids = read_and_split_data(args.data_folder)
     split_and_store_data(train_ids, test_ids, args.data_folder,
-                         args.output_train_folder, args.output_test_folder)
+                         args.output_train_folder, args.output_test_folder,
+                         media_mode=args.media_mode, media_workers=args.media_workers)
@@ -7,11 +7,14 @@ authors:
     matti.wiegmann@uni-weimar.de
 '''
 
-import json
 import sys
-import sklearn.metrics as skm
 import numpy as np
 
+from evaluation import (best_f1_threshold, classification_measures,
+                        classification_report, confusion_matrix,
+                        regression_measures)
+from jsonl import decoder
+
 UNDERLINE = '\033[4m'
 END = '\033[0m'
 
@@ -29,36 +32,35 @@ def write_result(key, value, file):
     file.write('measure {\n key: "' + key + '"\n value: "' + str(value) + '"\n}\n')
 
 
-def normalized_mean_squared_error(truth, predictions):
-    norm = skm.mean_squared_error(truth, np.full(len(truth), np.mean(truth)))
-    return skm.mean_squared_error(truth, predictions) / norm
-
+regression_measure_names = {'Explained variance': 'explained_variance',
+                            'Mean absolute error': 'mae',
+                            'Mean squared error': 'mse',
+                            'Median absolute error': 'median_ae',
+                            'R2 score': 'r2',
+                            'Normalized mean squared error': 'nmse'}
 
-regression_measures = {'Explained variance': skm.explained_variance_score,
-                       'Mean absolute error': skm.mean_absolute_error,
-                       'Mean squared error': skm.mean_squared_error,
-                       'Median absolute error': skm.median_absolute_error,
-                       'R2 score': skm.r2_score,
-                       'Normalized mean squared error': normalized_mean_squared_error}
-
-classification_measures = {'Accuracy': skm.accuracy_score,
-                           'Precision': skm.precision_score,
-                           'Recall': skm.recall_score,
-                           'F1 score': skm.f1_score}
+classification_measure_names = {'Accuracy': 'accuracy',
+                                'Precision': 'precision',
+                                'Recall': 'recall',
+                                'F1 score': 'f1'}
 
 if __name__ == "__main__":
     try:
-        with open(sys.argv[1], "r") as truth_file:
-            truth_dict = {json.loads(s)['id']: json.loads(s)['truthMean']
-                          for s in truth_file.readlines()}
-
-        with open(sys.argv[1], "r") as truth_file:
-            class_dict = {json.loads(s)['id']: json.loads(s)['truthClass']
-                          for s in truth_file.readlines()}
-
-        with open(sys.argv[2], "r") as preditcions_file:
-            predictions_dict = {json.loads(s)['id']: json.loads(s)['clickbaitScore']
-                                for s in preditcions_file.readlines()}
+        truth_dict = {}
+        class_dict = {}
+        decode = decoder(('id', 'truthMean', 'truthClass'))
+        with open(sys.argv[1], "rb") as truth_file:
+            for s in truth_file:
+                item = decode(s)
+                truth_dict[item['id']] = item['truthMean']
+                class_dict[item['id']] = item['truthClass']
+
+        predictions_dict = {}
+        decode = decoder(('id', 'clickbaitScore'))
+        with open(sys.argv[2], "rb") as preditcions_file:
+            for s in preditcions_file:
+                item = decode(s)
+                predictions_dict[item['id']] = item['clickbaitScore']
     except (KeyError, IndexError):
         usage()
 
@@ -74,30 +76,35 @@ if __name__ == "__main__":
         print('missing id in predictions.')
         exit()
 
+    truth = np.array(truth, dtype=np.float64)
+    predictions = np.array(predictions, dtype=np.float64)
+    classes = np.array([t != 'no-clickbait' for t in classes])
+
     try:
         with open(sys.argv[3], 'w') as output_file:
             print(UNDERLINE + '\nDataset Stats' + END)
             write_result('Size', len(truth), output_file)
-            sum_clickbait = sum(1 for x in classes if x == 'clickbait')
+            sum_clickbait = int(classes.sum())
             write_result('#Clickbait', sum_clickbait, output_file)
             write_result('#No-Clickbait', len(truth) - sum_clickbait, output_file)
 
             print(UNDERLINE + '\nRegression scores' + END)
-            for name in regression_measures:
-                write_result(name,
-                             regression_measures[name](truth, predictions),
-                             output_file)
+            measures = regression_measures(truth, predictions)
+            for name in regression_measure_names:
+                write_result(name, measures[regression_measure_names[name]], output_file)
 
             print(UNDERLINE + '\nBinary classification scores' + END)
-            classes = [0 if t == 'no-clickbait' else 1 for t in classes]
-            predictions = [0 if t < 0.5 else 1 for t in predictions]
-            for name in classification_measures:
-                write_result(name,
-                             classification_measures[name](classes, predictions),
-                             output_file)
+            matrix = confusion_matrix(classes, predictions >= 0.5)
+            measures = classification_measures(matrix)
+            for name in classification_measure_names:
+                write_result(name, measures[classification_measure_names[name]], output_file)
 
             print(UNDERLINE + '\nClassification report' + END)
-            print(skm.classification_report(classes, predictions))
+            print(classification_report(matrix, target_names=('0', '1')))
+
+            print(UNDERLINE + '\nBest F1 threshold' + END)
+            best = best_f1_threshold(classes, predictions)
+            print('clickbaitScore >= {threshold}: F1 score {f1}, precision {precision}, recall {recall}'.format(**best))
 
     except IndexError:
         print('no output file specified.')
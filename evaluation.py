@@ -0,0 +1,164 @@
+import numpy as np
+
+
+def regression_measures(truth, predictions):
+    # the regression measures of the clickbait challenge, from one array of
+    # errors; explained variance and R2 follow sklearn when truth is constant
+    truth = np.ravel(np.asarray(truth, dtype=np.float64))
+    predictions = np.ravel(np.asarray(predictions, dtype=np.float64))
+    errors = predictions - truth
+    absolute_errors = np.abs(errors)
+    variance = truth.var()
+    mse = np.mean(errors ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nmse = mse / variance
+    return {'explained_variance': _ratio_score(errors.var(), variance),
+            'mae': float(absolute_errors.mean()),
+            'mse': float(mse),
+            'median_ae': float(np.median(absolute_errors)),
+            'r2': _ratio_score(mse, variance),
+            'nmse': float(nmse)}
+
+
+def _ratio_score(residual, variance):
+    if variance == 0:
+        return 1.0 if residual == 0 else 0.0
+    return float(1 - residual / variance)
+
+
+def confusion_matrix(classes, predicted):
+    # 2x2 counts, rows the true class and columns the predicted one, with
+    # the negative class first
+    classes = np.ravel(classes).astype(np.int64) != 0
+    predicted = np.ravel(predicted).astype(np.int64) != 0
+    return np.bincount(2 * classes + predicted, minlength=4).reshape(2, 2)
+
+
+def classification_measures(matrix):
+    # accuracy, precision, recall and F1 of the positive class; like sklearn
+    # a measure with an empty denominator is 0
+    (tn, fp), (fn, tp) = matrix
+    return {'accuracy': _safe_ratio(tp + tn, matrix.sum()),
+            'precision': _safe_ratio(tp, tp + fp),
+            'recall': _safe_ratio(tp, tp + fn),
+            'f1': _safe_ratio(2 * tp, 2 * tp + fp + fn)}
+
+
+def _safe_ratio(numerator, denominator):
+    return float(numerator) / float(denominator) if denominator else 0.0
+
+
+def best_f1_threshold(classes, scores):
+    # The cutoff t (predicting clickbait for score >= t) with the highest
+    # F1, trying every distinct score in one pass over the scores sorted
+    # from high to low; ties go to the higher cutoff.
+    classes = np.ravel(classes).astype(np.int64) != 0
+    scores = np.ravel(np.asarray(scores, dtype=np.float64))
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    true_positives = np.cumsum(classes[order])
+    # the last position of every run of equal scores is where that score,
+    # as a cutoff, stops counting predictions as positive
+    last = np.append(sorted_scores[1:] != sorted_scores[:-1], True)
+    true_positives = true_positives[last]
+    predicted_positives = np.flatnonzero(last) + 1
+    positives = classes.sum()
+    f1 = 2.0 * true_positives / (predicted_positives + positives)
+    best = int(np.argmax(f1))
+    return {'threshold': float(sorted_scores[last][best]),
+            'f1': float(f1[best]),
+            'precision': _safe_ratio(true_positives[best], predicted_positives[best]),
+            'recall': _safe_ratio(true_positives[best], positives)}
+
+
+def evaluate(truth_means, scores, classes=None, threshold=0.5, sweep_thresholds=False):
+    # regression measures on the scores plus the classification measures at
+    # threshold, with classes derived from the truth means when not given;
+    # sweep_thresholds adds the best-F1 cutoff as best_threshold/best_f1
+    truth_means = np.ravel(np.asarray(truth_means, dtype=np.float64))
+    scores = np.ravel(np.asarray(scores, dtype=np.float64))
+    if classes is None:
+        classes = truth_means >= threshold
+    measures = regression_measures(truth_means, scores)
+    measures.update(classification_measures(confusion_matrix(classes, scores >= threshold)))
+    if sweep_thresholds:
+        best = best_f1_threshold(classes, scores)
+        measures['best_threshold'] = best['threshold']
+        measures['best_f1'] = best['f1']
+    return measures
+
+
+class RunningMeasures(object):
+    # Accumulates the confusion matrix and the sums behind the regression
+    # measures chunk by chunk, so scoring a stream can be evaluated in
+    # constant memory. The median absolute error needs every error and is
+    # left out; so is the best-F1 threshold, which needs every score.
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.matrix = np.zeros((2, 2), dtype=np.int64)
+        self.count = 0
+        self.truth_sum = 0.0
+        self.truth_squared_sum = 0.0
+        self.error_sum = 0.0
+        self.squared_error_sum = 0.0
+        self.absolute_error_sum = 0.0
+
+    def update(self, truth_means, scores, classes=None):
+        truth_means = np.ravel(np.asarray(truth_means, dtype=np.float64))
+        scores = np.ravel(np.asarray(scores, dtype=np.float64))
+        if classes is None:
+            classes = truth_means >= self.threshold
+        errors = scores - truth_means
+        self.matrix += confusion_matrix(classes, scores >= self.threshold)
+        self.count += len(truth_means)
+        self.truth_sum += truth_means.sum()
+        self.truth_squared_sum += np.dot(truth_means, truth_means)
+        self.error_sum += errors.sum()
+        self.squared_error_sum += np.dot(errors, errors)
+        self.absolute_error_sum += np.abs(errors).sum()
+
+    def measures(self):
+        if not self.count:
+            return {}
+        variance = max(self.truth_squared_sum / self.count - (self.truth_sum / self.count) ** 2, 0.0)
+        mse = float(self.squared_error_sum / self.count)
+        error_variance = max(mse - (self.error_sum / self.count) ** 2, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nmse = np.float64(mse) / variance
+        measures = {'explained_variance': _ratio_score(error_variance, variance),
+                    'mae': float(self.absolute_error_sum / self.count),
+                    'mse': mse,
+                    'r2': _ratio_score(mse, variance),
+                    'nmse': float(nmse)}
+        measures.update(classification_measures(self.matrix))
+        return measures
+
+
+def classification_report(matrix, target_names=('no-clickbait', 'clickbait')):
+    # per-class precision/recall/F1/support table in the layout of
+    # sklearn's classification_report, from the confusion matrix
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+    width = max(len(name) for name in target_names + ('weighted avg',))
+    lines = ['{:>{width}}  {:>9} {:>9} {:>9} {:>9}'.format(
+        '', 'precision', 'recall', 'f1-score', 'support', width=width), '']
+    rows = []
+    for i, name in enumerate(target_names):
+        precision = _safe_ratio(matrix[i, i], predicted[i])
+        recall = _safe_ratio(matrix[i, i], support[i])
+        f1 = _safe_ratio(2 * precision * recall, precision + recall)
+        rows.append((precision, recall, f1))
+        lines.append('{:>{width}}  {:>9.2f} {:>9.2f} {:>9.2f} {:>9}'.format(
+            name, precision, recall, f1, support[i], width=width))
+    total = support.sum()
+    lines.append('')
+    lines.append('{:>{width}}  {:>9} {:>9} {:>9.2f} {:>9}'.format(
+        'accuracy', '', '', _safe_ratio(np.trace(matrix), total), total, width=width))
+    rows = np.array(rows)
+    lines.append('{:>{width}}  {:>9.2f} {:>9.2f} {:>9.2f} {:>9}'.format(
+        'macro avg', *rows.mean(axis=0), total, width=width))
+    weighted = (rows * support[:, None]).sum(axis=0) / total if total else np.zeros(3)
+    lines.append('{:>{width}}  {:>9.2f} {:>9.2f} {:>9.2f} {:>9}'.format(
+        'weighted avg', *weighted, total, width=width))
+    return '\n'.join(lines) + '\n'
@@ -1,20 +1,23 @@
 import argparse
-from json import loads
-from os import listdir, mkdir
-from os.path import isdir, join
-from shutil import copy
+from concurrent.futures import ThreadPoolExecutor
+from os import mkdir
+from os.path import isdir, isfile, join
 
 import numpy as np
 
 from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 
+from jsonl import decoder
+
 
 def read_and_split_data(data_folder):
     truths_file_path = join(data_folder, 'truth.jsonl')
 
+    decode = decoder(('id', 'truthClass'))
+
     def get_id_and_class(truth_row):
-        truth_row = loads(truth_row)
+        truth_row = decode(truth_row)
         return [truth_row['id'], truth_row['truthClass']]
 
     with open(truths_file_path, 'r') as truths_file:
@@ -25,10 +28,10 @@ def read_and_split_data(data_folder):
                                             0], truth_class_per_instance[:, 1]
     
 
-    return ids, []
+    return set(ids), set()
 
 
-def split_and_store_data(train_ids, test_ids, data_folder, output_train_folder, output_test_folder):
+def split_and_store_data(train_ids, test_ids, data_folder, output_train_folder, output_test_folder, verify_media=False, media_workers=8):
     input_instances_file_path = join(data_folder, 'instances.jsonl')
     input_truths_file_path = join(data_folder, 'truth.jsonl')
 
@@ -46,25 +49,53 @@ def split_and_store_data(train_ids, test_ids, data_folder, output_train_folder,
     output_train_truths_file_path = join(output_train_folder, 'truth.jsonl')
     output_test_truths_file_path = join(output_test_folder, 'truth.jsonl')
 
-    store_sampled_data(train_ids, input_instances_file_path,
-                       output_train_instances_file_path, check_for_images=True)
-    store_sampled_data(train_ids, input_truths_file_path,
-                       output_train_truths_file_path)
-
-    store_sampled_data(test_ids, input_instances_file_path,
-                       output_test_instances_file_path, check_for_images=True)
-    store_sampled_data(test_ids, input_truths_file_path,
-                       output_test_truths_file_path)
-
-
-def store_sampled_data(ids, input_path, output_path, check_for_images=False):
-    with open(input_path, 'r', encoding="utf8") as input_file, open(output_path, 'w', encoding="utf8") as output_file:
+    image_ids = index_ids_with_images(input_instances_file_path,
+                                      data_folder=data_folder if verify_media else None, workers=media_workers)
+    print("Number of instances with images: {}".format(len(image_ids)))
+
+    train_ids = set(train_ids) & image_ids
+    test_ids = set(test_ids) & image_ids
+    store_split_data(train_ids, test_ids, input_instances_file_path,
+                     output_train_instances_file_path, output_test_instances_file_path)
+    store_split_data(train_ids, test_ids, input_truths_file_path,
+                     output_train_truths_file_path, output_test_truths_file_path)
+
+
+def index_ids_with_images(instances_path, data_folder=None, workers=8):
+    # One pass over instances.jsonl collecting the ids with a non-empty
+    # postMedia. With data_folder, only ids whose media files all exist
+    # under it are kept; the files are checked on a thread pool.
+    decode = decoder(('id', 'postMedia'))
+    media_per_id = {}
+    with open(instances_path, 'r', encoding="utf8") as instances_file:
+        for line in instances_file:
+            line_as_dict = decode(line)
+            if line_as_dict['postMedia']:
+                media_per_id[line_as_dict['id']] = line_as_dict['postMedia']
+    if data_folder is None:
+        return set(media_per_id)
+
+    media_paths = sorted(set(media_path for media in media_per_id.values()
+                             for media_path in media))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        found = pool.map(lambda media_path: isfile(join(data_folder, media_path)), media_paths)
+        existing = set(media_path for media_path, is_found in zip(
+            media_paths, tqdm(found, total=len(media_paths), desc="Checking images")) if is_found)
+    return set(instance_id for instance_id, media in media_per_id.items()
+               if all(media_path in existing for media_path in media))
+
+
+def store_split_data(train_ids, test_ids, input_path, output_train_path, output_test_path):
+    decode = decoder(('id',))
+    with open(input_path, 'r', encoding="utf8") as input_file, \
+            open(output_train_path, 'w', encoding="utf8") as output_train_file, \
+            open(output_test_path, 'w', encoding="utf8") as output_test_file:
         for line in input_file:
-            line_as_dict = loads(line)
-            if line_as_dict['id'] in ids:
-                if check_for_images and not line_as_dict['postMedia']:
-                    continue
-                output_file.write(line)
+            line_id = decode(line)['id']
+            if line_id in train_ids:
+                output_train_file.write(line)
+            elif line_id in test_ids:
+                output_test_file.write(line)
 
 
 if __name__ == "__main__":
@@ -75,8 +106,13 @@ if __name__ == "__main__":
                         help="Folder containing training data we acquired by sampling")
     parser.add_argument('--output-test-folder',
                         help="Folder containing test data we acquired by sampling")
+    parser.add_argument('--verify-media', action='store_true',
+                        help="Also drop instances whose media files are missing from the data folder")
+    parser.add_argument('--media-workers', type=int, default=8,
+                        help="Number of threads checking media files")
     args = parser.parse_args()
 
     train_ids, test_ids = read_and_split_data(args.data_folder)
     split_and_store_data(train_ids, test_ids, args.data_folder,
-                         args.output_train_folder, args.output_test_folder)
+                         args.output_train_folder, args.output_test_folder,
+                         verify_media=args.verify_media, media_workers=args.media_workers)
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+from os.path import join
+
+import numpy as np
+import tensorflow as tf
+from tqdm import tqdm
+
+from caption import build_inference_graph, read_images_ahead, session_config
+from jsonl import read_jsonl
+
+
+def extract_image_features(data_folder, dtype='float32', prefetch=64):
+    # Runs the image side of the Show-and-Tell graph once per media file and
+    # stores the resulting initial LSTM state as that image's feature vector
+    # in <data_folder>/image_features.npy (row 0 is all zeros). Writes
+    # image2idx.json (media file name -> row) for caption.py and
+    # id2imageidx.json (instance id -> row of its first image, 0 without
+    # one) for data_reader(use_image=True).
+    media_folder = join(data_folder, 'media')
+    available = set(os.listdir(media_folder))
+    id2images = {}
+    for instance in read_jsonl(join(data_folder, 'instances.jsonl'), fields=('id', 'postMedia')):
+        id2images[instance["id"]] = [os.path.basename(media_path) for media_path in instance["postMedia"]
+                                     if os.path.basename(media_path) in available]
+    images = sorted(set(image for instance_images in id2images.values()
+                        for image in instance_images))
+    image2idx = {image: row for row, image in enumerate(images, 1)}
+
+    features_path = join(data_folder, 'image_features.npy')
+    tmp_path = features_path + '.tmp'
+    features = None
+    g, model, restore_fn = build_inference_graph()
+    with tf.Session(graph=g, config=session_config()) as sess:
+        restore_fn(sess)
+        encoded_images = read_images_ahead([join(media_folder, image) for image in images], prefetch=prefetch)
+        for row, (_, encoded_image) in enumerate(tqdm(encoded_images, total=len(images), desc="Extracting features"), 1):
+            state = model.feed_image(sess, encoded_image)[0]
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    tmp_path, mode='w+', dtype=dtype, shape=(len(images) + 1, len(state)))
+                features[0] = 0
+            features[row] = state
+    if features is None:
+        with open(tmp_path, 'wb') as fout:
+            np.save(fout, np.zeros((1, 0), dtype=dtype))
+    else:
+        features.flush()
+        del features
+    os.replace(tmp_path, features_path)
+
+    with open(join(data_folder, 'image2idx.json'), 'w') as fout:
+        json.dump(image2idx, fout)
+    with open(join(data_folder, 'id2imageidx.json'), 'w') as fout:
+        json.dump({instance_id: image2idx[instance_images[0]] if instance_images else 0
+                   for instance_id, instance_images in id2images.items()}, fout)
+    print("Stored features of {} images in {}".format(len(images), features_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--data-folder', help="Folder containing instances.jsonl and the media folder")
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                        help="Storage type of the features; float16 halves the file at some precision")
+    parser.add_argument('--prefetch', type=int, default=64,
+                        help="Number of images read ahead of the model")
+    args = parser.parse_args()
+
+    extract_image_features(args.data_folder, dtype=args.dtype, prefetch=args.prefetch)
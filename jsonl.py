@@ -0,0 +1,63 @@
+import json
+import typing
+
+# Use the fastest JSON decoder that is installed: msgspec can skip the fields
+# a caller does not ask for without building them, orjson decodes everything
+# but much faster than the standard library, which is the fallback.
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if msgspec is not None:
+    BACKEND = 'msgspec'
+    loads = msgspec.json.Decoder().decode
+elif orjson is not None:
+    BACKEND = 'orjson'
+    loads = orjson.loads
+else:
+    BACKEND = 'json'
+    loads = json.loads
+
+
+def decoder(fields=None, backend=None):
+    # a function decoding one JSON line (str or bytes) into a dict holding
+    # only the given fields; a missing field raises KeyError
+    backend = backend or BACKEND
+    if backend == 'msgspec':
+        if fields is None:
+            return msgspec.json.Decoder().decode
+        fields = tuple(fields)
+        record_type = msgspec.defstruct(
+            'Record', [(each_field, typing.Any) for each_field in fields])
+        record_decoder = msgspec.json.Decoder(record_type)
+
+        def decode(line):
+            try:
+                record = record_decoder.decode(line)
+            except msgspec.ValidationError as error:
+                raise KeyError(str(error))
+            return {each_field: getattr(record, each_field) for each_field in fields}
+        return decode
+
+    full_loads = orjson.loads if backend == 'orjson' else json.loads
+    if fields is None:
+        return full_loads
+    fields = tuple(fields)
+
+    def decode(line):
+        item = full_loads(line)
+        return {each_field: item[each_field] for each_field in fields}
+    return decode
+
+
+def read_jsonl(path, fields=None, backend=None):
+    decode = decoder(fields, backend=backend)
+    with open(path, 'rb') as fin:
+        for each_line in fin:
+            if each_line.strip():
+                yield decode(each_line)
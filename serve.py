@@ -0,0 +1,206 @@
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from albacore import load_albacore, posts_to_ids, predict_scores
+from jsonl import loads
+
+
+class ServingStats(object):
+    # request latencies (the most recent `window` of them) and counters,
+    # shared by the handler threads and the batching thread
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.posts = 0
+        self.batches = 0
+        self.batched_posts = 0
+        self.errors = 0
+
+    def record_request(self, posts, latency):
+        with self.lock:
+            self.requests += 1
+            self.posts += posts
+            self.latencies.append(latency)
+
+    def record_batch(self, posts):
+        with self.lock:
+            self.batches += 1
+            self.batched_posts += posts
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            latencies = np.array(self.latencies) * 1000
+            return {
+                "uptime_s": uptime,
+                "requests": self.requests,
+                "posts": self.posts,
+                "errors": self.errors,
+                "batches": self.batches,
+                "mean_batch_size": self.batched_posts / self.batches if self.batches else 0.0,
+                "posts_per_s": self.posts / uptime if uptime else 0.0,
+                "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            }
+
+
+class MicroBatcher(object):
+    # Collects the id sequences of concurrent requests and scores them in
+    # one predict call, once max_batch_size posts are waiting or max_delay
+    # seconds have passed since the first of them arrived. The model is
+    # loaded and used only on the batching thread, so TensorFlow never sees
+    # more than one thread.
+
+    def __init__(self, load_model, stats, max_batch_size=64, max_delay=0.01):
+        self.requests = queue.Queue()
+        self.stats = stats
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.ready = threading.Event()
+        self.word2id = None
+        self.load_error = None
+        self.thread = threading.Thread(target=self._run, args=(load_model,), daemon=True)
+        self.thread.start()
+
+    def submit(self, sequences):
+        future = Future()
+        self.requests.put((sequences, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.time() + self.max_delay
+        while size < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+            size += len(batch[-1][0])
+        return batch
+
+    def _run(self, load_model):
+        try:
+            predict, self.word2id = load_model()
+        except Exception as error:
+            self.load_error = error
+            raise
+        finally:
+            self.ready.set()
+        while True:
+            batch = self._next_batch()
+            sequences = [each_sequence for each_sequences, _ in batch for each_sequence in each_sequences]
+            try:
+                scores = predict(sequences)
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            self.stats.record_batch(len(sequences))
+            offset = 0
+            for each_sequences, future in batch:
+                future.set_result(scores[offset:offset + len(each_sequences)])
+                offset += len(each_sequences)
+
+
+def make_handler(batcher, stats):
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+        # POST /score takes one post as a JSON object, or several as JSONL,
+        # each with an "id" and a "postText" (list or string), and answers in
+        # the same shape with {"id", "clickbaitScore"} records.
+        # GET /stats returns the counters and latency percentiles.
+
+        def _reply(self, status, body, content_type='application/json'):
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/stats':
+                return self._reply(404, json.dumps({"error": "not found"}))
+            self._reply(200, json.dumps(stats.snapshot()))
+
+        def do_POST(self):
+            if self.path != '/score':
+                return self._reply(404, json.dumps({"error": "not found"}))
+            start = time.time()
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                lines = [line for line in body.splitlines() if line.strip()]
+                posts = [loads(line) for line in lines]
+                if not all(isinstance(post, dict) for post in posts):
+                    raise ValueError("every post must be a JSON object")
+                ids = [post["id"] for post in posts]
+                sequences = posts_to_ids([post["postText"] for post in posts], batcher.word2id)
+            except (ValueError, KeyError, TypeError) as error:
+                stats.record_error()
+                return self._reply(400, json.dumps({"error": "bad request: {}".format(error)}))
+            try:
+                scores = batcher.submit(sequences).result()
+            except Exception as error:
+                stats.record_error()
+                return self._reply(500, json.dumps({"error": str(error)}))
+            results = [json.dumps({"id": each_id, "clickbaitScore": float(score)})
+                       for each_id, score in zip(ids, scores)]
+            stats.record_request(len(ids), time.time() - start)
+            if len(lines) == 1 and self.headers.get('Content-Type') != 'application/x-ndjson':
+                return self._reply(200, results[0])
+            self._reply(200, ''.join(result + '\n' for result in results), 'application/x-ndjson')
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+def load_albacore_predictor(word2id_path, weights_path, maxlen):
+    def load_model():
+        model, word2id = load_albacore(word2id_path, weights_path, maxlen=maxlen)
+        return (lambda sequences: predict_scores(model, sequences, maxlen=maxlen)), word2id
+    return load_model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
+    parser.add_argument('--word2id', default='word2id.json', help="Vocabulary the model was trained with")
+    parser.add_argument('--weights', default='weights_albacore.hdf5', help="Weights of the Albacore model")
+    parser.add_argument('--maxlen', type=int, default=42, help="Number of tokens posts are padded/cut to")
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                        help="Number of posts scored together at most, unless one request brings more")
+    parser.add_argument('--max-delay-ms', type=float, default=10,
+                        help="How long the first waiting post may wait for others to join its batch")
+    args = parser.parse_args()
+
+    stats = ServingStats()
+    batcher = MicroBatcher(load_albacore_predictor(args.word2id, args.weights, args.maxlen), stats,
+                           max_batch_size=args.max_batch_size, max_delay=args.max_delay_ms / 1000)
+    batcher.ready.wait()
+    if batcher.load_error is not None:
+        raise SystemExit("could not load the model: {}".format(batcher.load_error))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, stats))
+    print("Scoring on http://{}:{}/score, stats on /stats".format(args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,225 @@
+import csv
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+_worker_threads = 0
+
+
+def expand_grid(grid):
+    # {name: [values]} to one params dict per combination, in the order
+    # nested for-loops over the names would visit them
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def share_arrays(folder, **arrays):
+    # saves each array as folder/<name>.npy so that every job can
+    # memory-map it instead of receiving its own pickled copy
+    os.makedirs(folder, exist_ok=True)
+    paths = {}
+    for name, array in arrays.items():
+        path = os.path.join(folder, name + ".npy")
+        with open(path + ".tmp", "wb") as fout:
+            np.save(fout, np.ascontiguousarray(array))
+        os.replace(path + ".tmp", path)
+        paths[name] = path
+    return paths
+
+
+def load_shared(paths):
+    return {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+
+
+def digest_files(paths):
+    # content hash of the files a job reads, so results are only reused for
+    # the same data and embedding
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as fin:
+            for block in iter(lambda: fin.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def peak_memory_mb():
+    # peak resident memory of this process so far; run_sweep gives every
+    # job its own process, so for a job this is the job's own peak. On Linux
+    # it is read from VmHWM, which starts afresh with the process image,
+    # rather than from ru_maxrss, which a spawned process inherits from the
+    # parent it was forked from.
+    try:
+        with open("/proc/self/status") as fin:
+            for line in fin:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class ResultStore(object):
+    # Append-only CSV with a header, one row per finished job, that a sweep
+    # can be resumed from: rows are keyed on key_fields and `row in store`
+    # tells whether a job with the same key has already been run. Every row
+    # is flushed to disk as it is appended, and a row cut off by an
+    # interrupted run is dropped when the store is reopened. get() returns
+    # the stored row (values as strings, as read back from the CSV).
+
+    def __init__(self, path, fields, key_fields):
+        self.path = path
+        self.fields = list(fields)
+        self.key_fields = list(key_fields)
+        self.completed = {}
+        exists = os.path.isfile(path) and os.path.getsize(path) > 0
+        if exists:
+            self._drop_partial_row()
+            with open(path, "r", newline="") as fin:
+                reader = csv.DictReader(fin)
+                if reader.fieldnames != self.fields:
+                    raise ValueError("{} has the columns {}, expected {}; move it aside to start a new sweep".format(
+                        path, reader.fieldnames, self.fields))
+                for row in reader:
+                    self.completed[self.key(row)] = row
+        self.file = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fields)
+        if not exists:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def _drop_partial_row(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def key(self, row):
+        return tuple(str(row[field]) for field in self.key_fields)
+
+    def __contains__(self, row):
+        return self.key(row) in self.completed
+
+    def get(self, row, default=None):
+        return self.completed.get(self.key(row), default)
+
+    def __len__(self):
+        return len(self.completed)
+
+    def append(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.completed[self.key(row)] = {field: str(row[field]) for field in self.fields}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def halving_budgets(min_budget, max_budget, eta=3):
+    # max_budget, max_budget/eta, max_budget/eta**2, ... down to min_budget,
+    # in increasing order, e.g. [2, 6, 20] for 2, 20 and eta=3
+    budgets = [max_budget]
+    while budgets[0] // eta >= min_budget:
+        budgets.insert(0, budgets[0] // eta)
+    return budgets
+
+
+def successive_halving(run_rung, configs, budgets, eta=3, score="val_mse"):
+    # Successive halving: every config gets budgets[0], the best 1/eta of
+    # them by result[score] (lower is better) go on to budgets[1], and so on
+    # until budgets[-1]. run_rung(configs, budget, previous_budget) returns
+    # a (params, result) pair per config and may continue each config from
+    # where it stopped at previous_budget. Yields (budget, ranked results)
+    # after every rung.
+    def rank(result):
+        value = float(result[1][score])
+        return value if np.isfinite(value) else np.inf
+
+    survivors = list(configs)
+    previous_budget = None
+    for budget in budgets:
+        ranked = sorted(run_rung(survivors, budget, previous_budget), key=rank)
+        yield budget, ranked
+        survivors = [params for params, _ in ranked[:max(1, len(ranked) // eta)]]
+        previous_budget = budget
+
+
+def fresh_session():
+    # a new Keras graph and session for the next job, sized to the thread
+    # budget of this worker (0 lets TensorFlow use every core)
+    import keras.backend
+    import tensorflow as tf
+    keras.backend.clear_session()
+    keras.backend.set_session(tf.Session(config=tf.ConfigProto(
+        intra_op_parallelism_threads=_worker_threads,
+        inter_op_parallelism_threads=1 if _worker_threads else 0)))
+
+
+def _init_sweep_worker(threads):
+    global _worker_threads
+    _worker_threads = threads
+
+
+def _run_job(task):
+    run_job, params, context = task
+    start = time.time()
+    result = run_job(params, context)
+    cost = {"wall_time": time.time() - start, "peak_memory_mb": peak_memory_mb()}
+    return params, result, cost
+
+
+def run_sweep(run_job, jobs, workers=1, threads_per_worker=None):
+    # Runs run_job(params, context) for every (params, context) in jobs and
+    # yields (params, result, cost) as the jobs finish, cost being the
+    # job's wall time and peak memory. The jobs are spread over `workers`
+    # spawned processes that each get threads_per_worker threads (by default
+    # an equal share of the cores). Every job runs in a fresh process, also
+    # with a single worker, so its peak memory is not inflated by earlier
+    # jobs or by the data preparation in the parent. run_job must be
+    # importable by the workers, i.e. a module-level function.
+    tasks = [(run_job, params, context) for params, context in jobs]
+    if not tasks:
+        return
+    workers = max(1, min(workers, len(tasks)))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, multiprocessing.cpu_count() // workers)
+    # the BLAS/OpenMP pools are sized when the workers import numpy and
+    # TensorFlow, so their budget has to be in the environment they start with
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(threads_per_worker) for var in THREAD_ENV_VARS})
+    try:
+        # spawn, so no worker inherits TensorFlow state from the parent
+        pool = multiprocessing.get_context("spawn").Pool(
+            workers, initializer=_init_sweep_worker, initargs=(threads_per_worker,),
+            maxtasksperchild=1)
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+    with pool:
+        for finished in pool.imap_unordered(_run_job, tasks):
+            yield finished
@@ -12,6 +12,7 @@ from sklearn.model_selection import KFold
 import numpy as np
 import os
 import sys
+import argparse
 from sklearn import metrics
 import json
 import pickle
@@ -27,6 +28,9 @@ import keras.callbacks
 import re
 import nltk
 from tweet_utils import *
+from utils import Sequence_pader, read_ahead, read_truths, stream_instances
+from albacore import build_albacore_model, predict_scores
+from evaluation import RunningMeasures, best_f1_threshold, evaluate
 
 
 PAD = "<pad>"  
@@ -155,20 +159,6 @@ def data_reader(fps, word2id=None, y_len=1, use_target_description=False, use_im
 
 
 
-def Sequence_pader(sequences, maxlen):
-    if maxlen <= 0:
-        return sequences
-    shape = (len(sequences), maxlen)
-    padded_sequences = np.full(shape, 0)
-    for i, each_sequence in enumerate(sequences):
-        if len(each_sequence) > maxlen:
-            padded_sequences[i] = each_sequence[:maxlen]
-        else:
-            padded_sequences[i, :len(each_sequence)] = each_sequence
-    return padded_sequences
-
-
-
 def tweet_tokenizer(text):
     return simpleTokenize(squeezeWhitespace(text))
 
@@ -233,10 +223,20 @@ def tweet_processor(text):
 
 
 
-args = sys.argv
+parser = argparse.ArgumentParser()
+parser.add_argument('input_folder')
+parser.add_argument('output_folder')
+parser.add_argument('--chunk-size', type=int, default=0,
+                    help="Score instances.jsonl this many posts at a time, appending to results.jsonl after each chunk (0 reads the whole folder at once)")
+parser.add_argument('--read-ahead', type=int, default=1,
+                    help="Chunks tokenised ahead of the one being predicted when streaming (0 to not overlap them)")
+parser.add_argument('--workers', type=int, default=1, help="Tokeniser processes when streaming")
+parser.add_argument('--sweep-thresholds', action='store_true',
+                    help="With truth.jsonl, also report the best-F1 threshold; when streaming this keeps every score in memory")
+args = parser.parse_args()
 
-input_folder = args[1]
-output_folder = args[2]
+input_folder = args.input_folder
+output_folder = args.output_folder
 
 try:
     os.makedirs(output_folder)
@@ -250,6 +250,59 @@ with open('word2id.json', 'r') as fin:
     word2id = json.load(fin)
 
 output_add = os.path.join(output_folder,'results.jsonl')
+truth_add = os.path.join(input_folder,'truth.jsonl')
+
+
+def labelled_truths(ids, scores, id2truth):
+    # the scores of the ids truth.jsonl has labels for, with their truth
+    # means and classes
+    labelled = np.array([each_id in id2truth for each_id in ids], dtype=bool)
+    truth_means = np.array([id2truth[each_id][0][0] for each_id in ids if each_id in id2truth])
+    truth_classes = np.array([id2truth[each_id][1][0] for each_id in ids if each_id in id2truth])
+    return truth_means, truth_classes, np.ravel(scores)[labelled]
+
+
+def print_measures(measures):
+    for name in ['mse', 'accuracy', 'precision', 'recall', 'f1', 'best_threshold', 'best_f1']:
+        if name in measures:
+            print(name + ' = ' + str(measures[name]))
+
+model = build_albacore_model(len(word2id.keys()), maxlen=max_post_text_len)
+model.load_weights('weights_albacore.hdf5')
+
+if args.chunk_size:
+    # memory is bounded by chunk_size (times read_ahead + 1) instead of the input
+    chunks = stream_instances([input_folder], word2id=word2id, y_len=0,
+                              chunk_size=args.chunk_size, workers=args.workers)
+    if args.read_ahead:
+        chunks = read_ahead(chunks, args.read_ahead)
+    # with truth.jsonl the measures are accumulated chunk by chunk; only the
+    # threshold sweep needs to keep the scores
+    id2truth = read_truths(input_folder) if os.path.isfile(truth_add) else {}
+    running = RunningMeasures()
+    swept_classes = []
+    swept_scores = []
+    with open(output_add,'w') as fout:
+        for chunk in chunks:
+            petruth_means = predict_scores(model, [each.post_text for each in chunk], maxlen=max_post_text_len)
+            fout.write(''.join(json.dumps({"id": each.id, "clickbaitScore": float(each_score)})+'\n'
+                               for each, each_score in zip(chunk, petruth_means)))
+            fout.flush()
+            if id2truth:
+                truth_means, truth_classes, scores = labelled_truths(
+                    [each.id for each in chunk], petruth_means, id2truth)
+                running.update(truth_means, scores, classes=truth_classes)
+                if args.sweep_thresholds:
+                    swept_classes.append(truth_classes)
+                    swept_scores.append(scores)
+    if running.count:
+        measures = running.measures()
+        if args.sweep_thresholds:
+            best = best_f1_threshold(np.concatenate(swept_classes), np.concatenate(swept_scores))
+            measures['best_threshold'] = best['threshold']
+            measures['best_f1'] = best['f1']
+        print_measures(measures)
+    sys.exit()
 
 
 tetids, tepost_texts, tetruth_classes, tepost_text_lens, tetruth_means, tetarget_descriptions, tetarget_description_lens, teimage_features = data_reader(word2id=word2id, fps=[input_folder], y_len=0, use_target_description=False, use_image=False)
@@ -259,41 +312,22 @@ tepost_text_lens = [each_len if each_len <= max_post_text_len else max_post_text
 tepost_text_lens = np.array(tepost_text_lens)
 tetruth_means = np.array(tetruth_means)
 tetruth_means = np.ravel(tetruth_means).astype(np.float32)
-tepost_texts = keras.preprocessing.sequence.pad_sequences(tepost_texts, max_post_text_len)
-
-EmbeddingSize = 100
-max_features = len(word2id.keys())
-maxlen = max_post_text_len
-embedding_dims = EmbeddingSize
-dropout_embedding = 0.2
+tepost_texts = Sequence_pader(tepost_texts, max_post_text_len)
 
 X_test = tepost_texts
 y_test = tetruth_means
 
-model = Sequential()
-
-model.add(Embedding(input_dim = max_features,
-                    output_dim = embedding_dims,
-                    input_length = maxlen
-                    ,trainable = True))
-model.add(Dropout(dropout_embedding))
-
-model.add(Bidirectional(GRU(512, dropout_W=0.2, dropout_U=0.5)))  # try using a GRU instead, for fun
-model.add(Dense(1))
-model.add(Activation('sigmoid'))
-
-model.compile(loss='mse',
-              optimizer='rmsprop')
-
-model.load_weights('weights_albacore.hdf5')
-
 petruth_means = model.predict(X_test)
-tetruthClass = []
-petruthClass = []
 
 
 with open(output_add,'w') as fout:
     for i in range(len(tetids)):
         fout.write(json.dumps({"id": tetids[i], "clickbaitScore": float(petruth_means[i])})+'\n')
+
+if os.path.isfile(truth_add):
+    truth_means, truth_classes, scores = labelled_truths(tetids, petruth_means, read_truths(input_folder))
+    if len(truth_means):
+        print_measures(evaluate(truth_means, scores, classes=truth_classes,
+                                sweep_thresholds=args.sweep_thresholds))
     
     
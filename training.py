@@ -0,0 +1,81 @@
+import keras.callbacks
+import numpy as np
+
+
+class TrainingControl(keras.callbacks.Callback):
+    # Early stopping on a validation quantity (val_loss by default) that
+    # puts the weights of the best epoch back when training ends, whether it
+    # stopped early or ran out of epochs. Unlike EarlyStopping it fails
+    # loudly when the monitored quantity is not logged at all, instead of
+    # silently training for every epoch. summary() reports how many of the
+    # planned epochs were saved.
+
+    def __init__(self, monitor='val_loss', patience=7, min_delta=0.0, verbose=1):
+        super(TrainingControl, self).__init__()
+        self.monitor = monitor
+        self.patience = patience
+        self.min_delta = min_delta
+        self.verbose = verbose
+
+    def on_train_begin(self, logs=None):
+        self.wait = 0
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+        self.first_epoch = None
+        self.epochs_run = 0
+        self.stopped_early = False
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if self.first_epoch is None:
+            self.first_epoch = epoch
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        if self.monitor not in logs:
+            raise ValueError("{} is not logged (available: {}); training needs validation data to be "
+                             "controlled on it".format(self.monitor, ", ".join(sorted(logs))))
+        self.epochs_run += 1
+        current = float(logs[self.monitor])
+        if current < self.best - self.min_delta:
+            self.best = current
+            self.best_epoch = epoch
+            self.best_weights = self.model.get_weights()
+            self.wait = 0
+            return
+        self.wait += 1
+        if self.wait >= self.patience:
+            self.stopped_early = True
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+        if self.verbose:
+            summary = self.summary()
+            print("Trained {epochs_run} of {epochs_planned} epochs ({epochs_saved} saved), restored epoch "
+                  "{best_epoch} with {monitor} = {best:.6f}".format(monitor=self.monitor, **summary))
+
+    def summary(self):
+        epochs_planned = self.params['epochs'] - (self.first_epoch or 0)
+        return {'epochs_run': self.epochs_run,
+                'epochs_planned': epochs_planned,
+                'epochs_saved': epochs_planned - self.epochs_run,
+                'stopped_early': self.stopped_early,
+                'best_epoch': None if self.best_epoch is None else self.best_epoch + 1,
+                'best': self.best}
+
+
+def training_callbacks(patience=7, reduce_lr_patience=None, reduce_lr_factor=0.2, min_lr=0.0,
+                       monitor='val_loss', verbose=1):
+    # the TrainingControl plus the callbacks list to pass to fit; with
+    # reduce_lr_patience the learning rate is also multiplied by
+    # reduce_lr_factor whenever monitor has not improved for that many
+    # epochs, which should be fewer than patience to have an effect
+    control = TrainingControl(monitor=monitor, patience=patience, verbose=verbose)
+    callbacks = [control]
+    if reduce_lr_patience:
+        callbacks.append(keras.callbacks.ReduceLROnPlateau(
+            monitor=monitor, factor=reduce_lr_factor, patience=reduce_lr_patience, min_lr=min_lr,
+            verbose=verbose))
+    return control, callbacks
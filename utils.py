@@ -1,20 +1,40 @@
+import collections
+import functools
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
-import pickle
+import queue
 import re
+import threading
 from collections import Counter
 
 import nltk
 import numpy as np
 
+from jsonl import read_jsonl
 from tweet_utils import simpleTokenize, squeezeWhitespace
 
 PAD = "<pad>"
 UNK = "<unk>"
 NLTK_TOKENIZER = nltk.tokenize.TweetTokenizer()
+INSTANCE_FIELDS = ("id", "postText", "targetTitle")
 
 
-def WordEmbeddingLoader(fp, embedding_size):
+def WordEmbeddingLoader(fp, embedding_size, use_cache=True):
+    # With use_cache the parsed matrix is kept next to fp as a float32 .npy
+    # plus a JSON vocabulary index and memory-mapped on later calls; it is
+    # rebuilt whenever the size or mtime of fp changes. The UNK row is drawn
+    # from the global RNG on every call, cached or not, so callers that seed
+    # before loading get the same row and the same random stream afterwards.
+    if use_cache:
+        cached = _load_embedding_cache(fp, embedding_size)
+        if cached is not None:
+            word2id, embedding, vocab = cached
+            embedding[1] = np.random.uniform(-0.1, 0.1, embedding_size)
+            return word2id, embedding, vocab
+
     embedding = []
     vocab = []
     linenumber = 0
@@ -38,122 +58,417 @@ def WordEmbeddingLoader(fp, embedding_size):
 
     extra_embedding = [np.zeros(embedding_size),
                        np.random.uniform(-0.1, 0.1, embedding_size)]
-    embedding = np.append(extra_embedding, embedding, 0)
+    embedding = np.append(extra_embedding, embedding, 0).astype(np.float32)
+    if use_cache:
+        _store_embedding_cache(fp, embedding_size, embedding, vocab)
+    return word2id, embedding, vocab
+
+
+def _embedding_cache_paths(fp):
+    base = os.path.splitext(fp)[0]
+    return base + '.cache.npy', base + '.cache.json'
+
+
+def _embedding_cache_key(fp, embedding_size):
+    stat = os.stat(fp)
+    return {"source_size": stat.st_size, "source_mtime": stat.st_mtime_ns,
+            "embedding_size": embedding_size}
+
+
+def _load_embedding_cache(fp, embedding_size):
+    matrix_path, index_path = _embedding_cache_paths(fp)
+    if not (os.path.isfile(matrix_path) and os.path.isfile(index_path)):
+        return None
+    with open(index_path, 'r', encoding='UTF-8') as fin:
+        index = json.load(fin)
+    if index["key"] != _embedding_cache_key(fp, embedding_size):
+        return None
+    # copy-on-write, so setting the UNK row only copies its page in memory
+    embedding = np.load(matrix_path, mmap_mode='c')
+    vocab = index["vocab"]
+    word2id = dict(zip(vocab, range(2, len(vocab)+2)))
+    word2id[PAD] = 0
+    word2id[UNK] = 1
     return word2id, embedding, vocab
 
 
-def data_reader(fps, word2id=None, y_len=1, use_target_description=False, use_image=False, delete_irregularities=False):
+def _store_embedding_cache(fp, embedding_size, embedding, vocab):
+    matrix_path, index_path = _embedding_cache_paths(fp)
+    # the index is written last so a half-written matrix is never picked up
+    if os.path.isfile(index_path):
+        os.remove(index_path)
+    tmp_path = matrix_path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        np.save(fout, embedding)
+    os.replace(tmp_path, matrix_path)
+    with open(index_path + '.tmp', 'w', encoding='UTF-8') as fout:
+        json.dump({"key": _embedding_cache_key(fp, embedding_size),
+                   "vocab": vocab}, fout)
+    os.replace(index_path + '.tmp', index_path)
+
+
+def corpus_vocabulary(fps, use_target_description=False):
+    # the token set data_reader will produce for the instances in fps
+    tokens = set()
+    fields = INSTANCE_FIELDS if use_target_description else ("postText",)
+    for fp in fps:
+        for each_item in read_jsonl(os.path.join(fp, 'instances.jsonl'), fields=fields):
+            texts = [" ".join(each_item["postText"])]
+            if use_target_description:
+                texts.append(each_item["targetTitle"])
+            for each_text in texts:
+                if not (each_text+" ").isspace():
+                    tokens.update(cached_tokeniser(each_text))
+    return tokens
+
+
+def prune_embedding(word2id, embedding, tokens):
+    # keep PAD/UNK plus the rows of tokens that are in the embedding, in
+    # their original order, and remap word2id onto the smaller matrix
+    vocab = sorted((each_token for each_token in tokens
+                    if word2id.get(each_token, 1) > 1), key=word2id.get)
+    rows = [0, 1] + [word2id[each_token] for each_token in vocab]
+    pruned_word2id = dict(zip(vocab, range(2, len(vocab)+2)))
+    pruned_word2id[PAD] = 0
+    pruned_word2id[UNK] = 1
+    return pruned_word2id, np.asarray(embedding[rows]), vocab
+
+
+def data_reader(fps, word2id=None, y_len=1, use_target_description=False, use_image=False, delete_irregularities=False, workers=1, cache_dir=None):
+    # with cache_dir the tokenised outputs are stored as .npz keyed on the
+    # input file contents, word2id and the reader options; image features
+    # and untokenised text are never cached
+    cache_path = None
+    if cache_dir and word2id and not use_image:
+        cache_path = os.path.join(cache_dir, "data_reader-" + _data_reader_cache_key(
+            fps, word2id, y_len, use_target_description, delete_irregularities) + ".npz")
+        if os.path.isfile(cache_path):
+            return _load_data_reader_cache(cache_path)
+    outputs = _read_data(fps, word2id, y_len, use_target_description,
+                         use_image, delete_irregularities, workers)
+    if cache_path:
+        _store_data_reader_cache(cache_path, outputs)
+    return outputs
+
+
+def _data_reader_cache_key(fps, word2id, y_len, use_target_description, delete_irregularities):
+    digest = hashlib.sha1()
+    for fp in fps:
+        for each_name in ['truth.jsonl', 'instances.jsonl']:
+            each_path = os.path.join(fp, each_name)
+            if not os.path.isfile(each_path):
+                continue
+            digest.update(each_name.encode('utf-8'))
+            with open(each_path, 'rb') as fin:
+                for each_block in iter(lambda: fin.read(1 << 20), b''):
+                    digest.update(each_block)
+    digest.update(json.dumps(word2id, sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps({"y_len": y_len,
+                              "use_target_description": use_target_description,
+                              "delete_irregularities": delete_irregularities,
+                              "tokeniser": "tweet_processor+TweetTokenizer"},
+                             sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _flatten_sequences(sequences):
+    lens = np.array([len(each_sequence)
+                     for each_sequence in sequences], dtype=np.int64)
+    flat = np.fromiter((each_id for each_sequence in sequences for each_id in each_sequence),
+                       dtype=np.int32, count=int(lens.sum()))
+    return flat, np.cumsum(lens)
+
+
+def _unflatten_sequences(flat, ends):
+    if not len(ends):
+        return []
+    return [each_sequence.tolist() for each_sequence in np.split(flat, ends[:-1])]
+
+
+def _store_data_reader_cache(cache_path, outputs):
+    ids, post_texts, truth_classes, post_text_lens, truth_means, target_descriptions, target_description_lens, _ = outputs
+    post_flat, post_ends = _flatten_sequences(post_texts)
+    target_flat, target_ends = _flatten_sequences(target_descriptions)
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        np.savez_compressed(fout, ids=np.array(ids, dtype=str),
+                            post_flat=post_flat, post_ends=post_ends,
+                            post_text_lens=np.array(
+                                post_text_lens, dtype=np.int64),
+                            truth_classes=np.array(truth_classes),
+                            truth_means=np.array(truth_means),
+                            target_flat=target_flat, target_ends=target_ends,
+                            target_description_lens=np.array(target_description_lens, dtype=np.int64))
+    os.replace(tmp_path, cache_path)
+
+
+def _load_data_reader_cache(cache_path):
+    with np.load(cache_path) as cache:
+        ids = cache["ids"].tolist()
+        post_texts = _unflatten_sequences(cache["post_flat"], cache["post_ends"])
+        target_descriptions = _unflatten_sequences(
+            cache["target_flat"], cache["target_ends"])
+        return (ids, post_texts, cache["truth_classes"].tolist(), cache["post_text_lens"].tolist(),
+                cache["truth_means"].tolist(), target_descriptions,
+                cache["target_description_lens"].tolist(), [[] for _ in ids])
+
+
+Instance = collections.namedtuple('Instance', [
+    'id', 'post_text', 'post_text_len', 'truth_mean', 'truth_class',
+    'target_description', 'target_description_len', 'image_feature'])
+
+
+def load_image_features(fp):
+    # the per-image features image_features.py extracted for fp: instance id
+    # -> row, media file name -> row, and the memory-mapped feature matrix,
+    # whose row 0 is all zeros for instances without an image
+    with open(os.path.join(fp, "id2imageidx.json"), "r") as fin:
+        id2imageidx = json.load(fin)
+    with open(os.path.join(fp, "image2idx.json"), "r") as fin:
+        image2idx = json.load(fin)
+    features = np.load(os.path.join(fp, "image_features.npy"), mmap_mode='r')
+    return id2imageidx, image2idx, features
+
+
+def _read_data(fps, word2id, y_len, use_target_description, use_image, delete_irregularities, workers):
     ids = []
     post_texts = []
     post_text_lens = []
     truth_means = []
     truth_classes = []
-    id2truth_class = {}
-    id2truth_mean = {}
     target_descriptions = []
     target_description_lens = []
     image_features = []
+    for each_chunk in stream_instances(fps, word2id=word2id, y_len=y_len, use_target_description=use_target_description,
+                                       use_image=use_image, delete_irregularities=delete_irregularities,
+                                       chunk_size=4096 * max(workers, 1), workers=workers):
+        for each_instance in each_chunk:
+            ids.append(each_instance.id)
+            post_texts.append(each_instance.post_text)
+            if word2id:
+                post_text_lens.append(each_instance.post_text_len)
+            if y_len:
+                truth_means.append(each_instance.truth_mean)
+                truth_classes.append(each_instance.truth_class)
+            target_descriptions.append(each_instance.target_description)
+            if word2id or not use_target_description:
+                target_description_lens.append(
+                    each_instance.target_description_len)
+            image_features.append(each_instance.image_feature)
+    return ids, post_texts, truth_classes, post_text_lens, truth_means, target_descriptions, target_description_lens, image_features
+
+
+def read_truths(fp, y_len=1, delete_irregularities=False):
+    # id -> (truth mean, truth class) for one folder's truth.jsonl
+    id2truth = {}
+    fields = ("id", "truthClass", "truthMean")
+    if y_len == 4:
+        fields += ("truthJudgments",)
+    for each_item in read_jsonl(os.path.join(fp, 'truth.jsonl'), fields=fields):
+        if delete_irregularities:
+            if each_item["truthClass"] == "clickbait" and float(each_item["truthMean"]) < 0.5 or each_item["truthClass"] != "clickbait" and float(each_item["truthMean"]) > 0.5:
+                continue
+        if y_len == 4:
+            each_label = [0, 0, 0, 0]
+
+            for each_key, each_value in Counter(each_item["truthJudgments"]).items():
+                each_label[int(each_key//0.3)
+                           ] = float(each_value)/5
+            if each_item["truthClass"] != "clickbait":
+                assert each_label[0] + \
+                    each_label[1] > each_label[2]+each_label[3]
+            else:
+                assert each_label[0] + \
+                    each_label[1] < each_label[2]+each_label[3]
+        elif y_len == 2:
+            if each_item["truthClass"] == "clickbait":
+                each_label = [1, 0]
+            else:
+                each_label = [0, 1]
+        elif each_item["truthClass"] == "clickbait":
+            each_label = [1]
+        else:
+            each_label = [0]
+        id2truth[each_item["id"]] = (
+            [float(each_item["truthMean"])], each_label)
+    return id2truth
+
+
+def stream_instances(fps, word2id=None, y_len=1, use_target_description=False, use_image=False, delete_irregularities=False,
+                     chunk_size=1024, workers=1):
+    # Yields lists of up to chunk_size Instance records in file order. Only
+    # the truth labels are indexed up front; instances.jsonl is read and
+    # tokenised one chunk at a time, so memory stays bounded by chunk_size.
+    id2truth = {}
     num = 0
-    for fp in fps:
-        if use_image:
-            with open(os.path.join(fp, "id2imageidx.json"), "r") as fin:
-                id2imageidx = json.load(fin)
-
-            all_image_features = pickle.load(
-                os.path.join(fp, "image_features.hkl"))
-        if y_len:
-            with open(os.path.join(fp, 'truth.jsonl'), 'rb') as fin:
-                for each_line in fin:
-                    each_item = json.loads(each_line.decode('utf-8'))
-                    if delete_irregularities:
-                        if each_item["truthClass"] == "clickbait" and float(each_item["truthMean"]) < 0.5 or each_item["truthClass"] != "clickbait" and float(each_item["truthMean"]) > 0.5:
-                            continue
-                    if y_len == 4:
-                        each_label = [0, 0, 0, 0]
-
-                        for each_key, each_value in Counter(each_item["truthJudgments"]).items():
-                            each_label[int(each_key//0.3)
-                                       ] = float(each_value)/5
-                        id2truth_class[each_item["id"]] = each_label
-                        if each_item["truthClass"] != "clickbait":
-                            assert each_label[0] + \
-                                each_label[1] > each_label[2]+each_label[3]
-                        else:
-                            assert each_label[0] + \
-                                each_label[1] < each_label[2]+each_label[3]
-                    if y_len == 2:
-                        if each_item["truthClass"] == "clickbait":
-                            id2truth_class[each_item["id"]] = [1, 0]
-                        else:
-                            id2truth_class[each_item["id"]] = [0, 1]
-                    if y_len == 1:
-                        if each_item["truthClass"] == "clickbait":
-                            id2truth_class[each_item["id"]] = [1]
-                        else:
-                            id2truth_class[each_item["id"]] = [0]
-                    id2truth_mean[each_item["id"]] = [
-                        float(each_item["truthMean"])]
-
-        with open(os.path.join(fp, 'instances.jsonl'), 'rb') as fin:
-            for each_line in fin:
-                each_item = json.loads(each_line.decode('utf-8'))
-                if each_item["id"] not in id2truth_class and y_len:
+    pool = None
+    if word2id and workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_texts_to_ids_worker,
+                                    initargs=(word2id,))
+    try:
+        for fp in fps:
+            if use_image:
+                id2imageidx, _, all_image_features = load_image_features(fp)
+            if y_len:
+                id2truth.update(read_truths(
+                    fp, y_len=y_len, delete_irregularities=delete_irregularities))
+
+            chunk = []
+            for each_item in read_jsonl(os.path.join(fp, 'instances.jsonl'), fields=INSTANCE_FIELDS):
+                if each_item["id"] not in id2truth and y_len:
                     num += 1
                     continue
-                ids.append(each_item["id"])
-                each_post_text = " ".join(each_item["postText"])
-                each_target_description = each_item["targetTitle"]
-                if y_len:
-                    truth_means.append(id2truth_mean[each_item["id"]])
-                    truth_classes.append(id2truth_class[each_item["id"]])
-                if word2id:
-                    if (each_post_text+" ").isspace():
-                        # the id of <unk>
-                        post_texts.append([0])
-                        post_text_lens.append(1)
-                    else:
-                        each_post_tokens = tokeniser(each_post_text)
-                        post_texts.append([word2id.get(each_token, 1)
-                                           for each_token in each_post_tokens])
-                        post_text_lens.append(len(each_post_tokens))
-                else:
-                    post_texts.append([each_post_text])
-                if use_target_description:
-                    if word2id:
-                        if (each_target_description+" ").isspace():
-                            target_descriptions.append([0])
-                            target_description_lens.append(1)
-                        else:
-                            each_target_description_tokens = tokeniser(
-                                each_target_description)
-                            target_descriptions.append(
-                                [word2id.get(each_token, 1) for each_token in each_target_description_tokens])
-                            target_description_lens.append(
-                                len(each_target_description_tokens))
-                    else:
-                        target_descriptions.append([each_target_description])
-                else:
-                    target_descriptions.append([])
-                    target_description_lens.append(0)
                 if use_image:
-                    image_features.append(
-                        all_image_features[id2imageidx[each_item["id"]]].flatten())
+                    each_image_feature = np.asarray(
+                        all_image_features[id2imageidx[each_item["id"]]], dtype=np.float32).flatten()
                 else:
-                    image_features.append([])
+                    each_image_feature = []
+                chunk.append((each_item["id"], " ".join(each_item["postText"]),
+                              each_item["targetTitle"], each_image_feature))
+                if len(chunk) == chunk_size:
+                    yield _chunk_to_instances(chunk, id2truth, word2id, y_len, use_target_description, pool, workers)
+                    chunk = []
+            if chunk:
+                yield _chunk_to_instances(chunk, id2truth, word2id, y_len, use_target_description, pool, workers)
+    finally:
+        if pool is not None:
+            pool.close()
     print("Deleted number of items: " + str(num))
-    return ids, post_texts, truth_classes, post_text_lens, truth_means, target_descriptions, target_description_lens, image_features
 
 
-def Sequence_pader(sequences, maxlen):
+def _chunk_to_instances(chunk, id2truth, word2id, y_len, use_target_description, pool, workers):
+    chunk_ids = [each[0] for each in chunk]
+    if word2id:
+        post_texts, post_text_lens = _texts_to_ids_with(
+            [each[1] for each in chunk], word2id, pool, workers)
+    else:
+        post_texts = [[each[1]] for each in chunk]
+        post_text_lens = [None for _ in chunk]
+    if not use_target_description:
+        target_descriptions = [[] for _ in chunk]
+        target_description_lens = [0 for _ in chunk]
+    elif word2id:
+        target_descriptions, target_description_lens = _texts_to_ids_with(
+            [each[2] for each in chunk], word2id, pool, workers)
+    else:
+        target_descriptions = [[each[2]] for each in chunk]
+        target_description_lens = [None for _ in chunk]
+    instances = []
+    for i, each_id in enumerate(chunk_ids):
+        truth_mean, truth_class = id2truth[each_id] if y_len else (
+            None, None)
+        instances.append(Instance(each_id, post_texts[i], post_text_lens[i], truth_mean, truth_class,
+                                  target_descriptions[i], target_description_lens[i], chunk[i][3]))
+    return instances
+
+
+def read_ahead(items, depth=1):
+    # yields items while a producer thread keeps computing up to depth of
+    # them ahead, e.g. tokenising the next stream_instances chunk while the
+    # current one is being predicted; producer errors are re-raised here
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put((item, None))
+        except Exception as error:
+            buffer.put((done, error))
+        else:
+            buffer.put((done, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    while True:
+        item, error = buffer.get()
+        if item is done:
+            break
+        yield item
+    producer.join()
+    if error is not None:
+        raise error
+
+
+def _texts_to_ids_with(texts, word2id, pool, workers):
+    if pool is None:
+        return _texts_to_ids(texts, word2id)
+    return _pool_texts_to_ids(pool, texts, workers)
+
+
+def texts_to_ids(texts, word2id, workers=1):
+    # tokenise texts and map them to ids; with workers > 1 contiguous chunks
+    # are handled by a process pool and reassembled in their original order
+    if workers <= 1 or len(texts) < 2 * workers:
+        return _texts_to_ids(texts, word2id)
+    with multiprocessing.Pool(workers, initializer=_init_texts_to_ids_worker,
+                              initargs=(word2id,)) as pool:
+        return _pool_texts_to_ids(pool, texts, workers)
+
+
+def _pool_texts_to_ids(pool, texts, workers):
+    chunk_size = -(-len(texts) // (workers * 4))
+    chunks = [texts[i:i+chunk_size]
+              for i in range(0, len(texts), chunk_size)]
+    ids, lens = [], []
+    for each_ids, each_lens in pool.map(_texts_to_ids_worker, chunks):
+        ids.extend(each_ids)
+        lens.extend(each_lens)
+    return ids, lens
+
+
+def _texts_to_ids(texts, word2id):
+    ids = []
+    lens = []
+    for each_text in texts:
+        if (each_text+" ").isspace():
+            # the id of <pad>
+            ids.append([0])
+            lens.append(1)
+        else:
+            each_tokens = cached_tokeniser(each_text)
+            ids.append([word2id.get(each_token, 1)
+                        for each_token in each_tokens])
+            lens.append(len(each_tokens))
+    return ids, lens
+
+
+_worker_word2id = None
+
+
+def _init_texts_to_ids_worker(word2id):
+    global _worker_word2id
+    _worker_word2id = word2id
+
+
+def _texts_to_ids_worker(texts):
+    return _texts_to_ids(texts, _worker_word2id)
+
+
+def Sequence_pader(sequences, maxlen, dtype='int32', padding='post', truncating='post', value=0):
+    # padding/truncating are 'pre' or 'post' as in keras' pad_sequences, but
+    # the default is post for both, which is what the models are trained on
     if maxlen <= 0:
         return sequences
-    shape = (len(sequences), maxlen)
-    padded_sequences = np.full(shape, 0)
-    for i, each_sequence in enumerate(sequences):
-        if len(each_sequence) > maxlen:
-            padded_sequences[i] = each_sequence[:maxlen]
-        else:
-            padded_sequences[i, :len(each_sequence)] = each_sequence
+    lens = np.fromiter((len(each_sequence) for each_sequence in sequences),
+                       dtype=np.int64, count=len(sequences))
+    flat = np.fromiter(itertools.chain.from_iterable(sequences),
+                       dtype=dtype, count=int(lens.sum()))
+    padded_sequences = np.full((len(sequences), maxlen), value, dtype=dtype)
+    kept_lens = np.minimum(lens, maxlen)
+    starts = np.cumsum(lens) - lens
+    if truncating == 'pre':
+        starts += lens - kept_lens
+    if padding == 'pre':
+        columns = maxlen - kept_lens
+    else:
+        columns = np.zeros_like(kept_lens)
+    rows = np.repeat(np.arange(len(sequences)), kept_lens)
+    positions = np.arange(int(kept_lens.sum())) - \
+        np.repeat(np.cumsum(kept_lens) - kept_lens, kept_lens)
+    padded_sequences[rows, np.repeat(columns, kept_lens) + positions] = \
+        flat[np.repeat(starts, kept_lens) + positions]
     return padded_sequences
 
 
@@ -163,12 +478,33 @@ def tweet_tokenizer(text):
 
 def tokeniser(text, with_process=True):
     if with_process:
-        return NLTK_TOKENIZER.tokenize(tweet_processor(text).lower())
+        return NLTK_TOKENIZER.tokenize(TWEET_NORMALIZER.normalize(text).lower())
     else:
         # return NLTK_TOKENIZER.tokenize(text)
         return tweet_tokenizer(text.lower())
 
 
+def _make_cached_tokeniser(maxsize):
+    @functools.lru_cache(maxsize=maxsize)
+    def cached_tokeniser(text):
+        return tuple(tokeniser(text))
+    return cached_tokeniser
+
+
+# posts and target titles repeat a lot, so data_reader tokenises through a
+# bounded LRU cache; tokeniser_cache_info() reports its hits and misses
+cached_tokeniser = _make_cached_tokeniser(maxsize=2 ** 16)
+
+
+def set_tokeniser_cache_size(maxsize):
+    global cached_tokeniser
+    cached_tokeniser = _make_cached_tokeniser(maxsize)
+
+
+def tokeniser_cache_info():
+    return cached_tokeniser.cache_info()
+
+
 def tweet_processor(text):
     FLAGS = re.MULTILINE | re.DOTALL
 
@@ -219,3 +555,63 @@ def tweet_processor(text):
     text = re_sub(r"([A-Z]){2,}", allcaps)
 
     return text
+
+
+class TweetNormalizer(object):
+    # Same passes as tweet_processor, compiled once. The passes stay
+    # sequential: each one rewrites the output of the previous ones (e.g. the
+    # <number> pass sees what the emoticon passes left behind), so merging
+    # them into one alternation would change the output.
+
+    FLAGS = re.MULTILINE | re.DOTALL
+    EYES = r"[8:=;]"
+    NOSE = r"['`\-]?"
+
+    def __init__(self):
+        eyes, nose = self.EYES, self.NOSE
+        self._capital_split = re.compile(r"(?=[A-Z])", self.FLAGS)
+        self._passes = [(re.compile(pattern, self.FLAGS), repl) for pattern, repl in [
+            (r"https?:\/\/\S+\b|www\.(\w+\.)+\S*", "<url>"),
+            (r"/", " / "),
+            (r"@\w+", "<user>"),
+            (r"{}{}[)dD]+|[)dD]+{}{}".format(eyes,
+                                            nose, nose, eyes), "<smile>"),
+            (r"{}{}p+".format(eyes, nose), "<lolface>"),
+            (r"{}{}\(+|\)+{}{}".format(eyes, nose, nose, eyes), "<sadface>"),
+            (r"{}{}[\/|l*]".format(eyes, nose), "<neutralface>"),
+            (r"<3", "<heart>"),
+            (r"[-+]?[.\d]*[\d]+[:,.\d]*", "<number>"),
+            (r"#\S+", self._hashtag),
+            (r"([!?.]){2,}", r"\1 <repeat>"),
+            (r"\b(\S*?)(.)\2{2,}\b", r"\1\2 <elong>"),
+            (r"([A-Z]){2,}", self._allcaps),
+        ]]
+
+    def _hashtag(self, match):
+        hashtag_body = match.group()[1:]
+        splits = [(m.start(), m.end())
+                  for m in self._capital_split.finditer(hashtag_body)]
+        starts = [0] + [i[1] for i in splits]
+        ends = [i[0] for i in splits] + [len(hashtag_body)]
+        return " ".join(["<hashtag>"] + [hashtag_body[start:end] for start, end in zip(starts, ends)])
+
+    @staticmethod
+    def _allcaps(match):
+        return match.group().lower() + " <allcaps>"
+
+    def normalize(self, text):
+        for pattern, repl in self._passes:
+            text = pattern.sub(repl, text)
+        return text
+
+    def normalize_batch(self, texts):
+        passes = self._passes
+        normalized = []
+        for text in texts:
+            for pattern, repl in passes:
+                text = pattern.sub(repl, text)
+            normalized.append(text)
+        return normalized
+
+
+TWEET_NORMALIZER = TweetNormalizer()